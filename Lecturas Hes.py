@@ -1,14 +1,26 @@
 import streamlit as st
 import pandas as pd
 import folium
-from streamlit_folium import folium_static
+from streamlit_folium import folium_static, st_folium
 from folium.plugins import Fullscreen  
 from sqlalchemy import create_engine
 import psycopg2
 import json
-import urllib.parse
+import html
 import plotly.express as px
-import time
+import plotly.graph_objects as go
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from hes_utils import (COLORES_CONSUMO, MAPEO_NOMBRES, OPCIONES_POOL, RANGOS_PREDEFINIDOS, AlmacenDiario, AsignacionSectores, CacheLecturas, RefrescoFondo,
+                       agregado_diario, agregado_medidores, clave_lecturas, rango_predefinido, version_datos, version_rango,
+                       clasificar_consumo, consumo_por_sector, IndiceFiltros, indice_filtros, leer_agregado_diario, leer_agregado_medidores, leer_historico, leer_sectores_geojson,
+                       Cronometro, curva_pareto, frecuencia_automatica, ranking_consumo, registrar_rendimiento, remuestrear_diario,
+                       tamano_df, top_k_con_otros, url_mysql)
+from rollups_hes import cobertura_rollups, leer_rollup_diario, leer_rollup_medidores, meses_completos, rollups_cubren
+from alarmas_hes import COLORES_ALARMA, detectar_alarmas, resumen_alarmas
+from mapa_hes import (MODOS_CAPA_MEDIDORES, CapaMedidoresCanvas, IndiceEspacial, capa_alarmas, capa_coropletas, capa_vista, cluster_medidores, limites_aproximados,
+                      limites_folium, resolver_modo_capa)
 
 # 1. CONFIGURACIÓN
 st.set_page_config(
@@ -17,6 +29,10 @@ st.set_page_config(
     layout="wide"  
 )
 
+# Tiempos por etapa de esta ejecución (panel "⏱️ RENDIMIENTO" al final de la barra lateral)
+crono = Cronometro()
+depurar = st.session_state.get("panel_rendimiento", False)
+
 # ESTILO CSS
 st.markdown("""
     <style>
@@ -85,7 +101,7 @@ st.markdown("""
         }
 
         /* Añadir dentro del bloque de estilo CSS existente */
-        iframe[title="streamlit_folium.folium_static"] {
+        iframe[title="streamlit_folium.folium_static"], iframe[title="streamlit_folium.st_folium"] {
             border: 3px solid #444444 !important; /* Color gris oscuro */
             border-radius: 10px; /* Bordes redondeados para un acabado moderno */
             box-shadow: 0px 4px 15px rgba(0, 0, 0, 0.5); /* Sombra suave para dar profundidad */
@@ -121,77 +137,174 @@ URL_LOGO_MIAA = "https://raw.githubusercontent.com/Miaa-Aguascalientes/Lecturas-
 @st.cache_resource
 def get_mysql_engine():
     try:
-        creds = st.secrets["mysql"]
-        user = creds["user"]
-        pwd = urllib.parse.quote_plus(creds["password"])
-        host = creds["host"]
-        db = creds["database"]
-        conn_str = f"mysql+mysqlconnector://{user}:{pwd}@{host}/{db}"
-        return create_engine(conn_str)
+        conn_str = url_mysql(st.secrets["mysql"])
+        return create_engine(conn_str, **OPCIONES_POOL)
     except Exception as e:
         st.error(f"Error configurando motor MySQL: {e}")
         return None
 
 @st.cache_resource
-def get_postgres_conn():
+def get_postgres_engine():
+    # Pool de conexiones psycopg2: cada consulta toma una conexión y la devuelve al terminar
     try:
-        return psycopg2.connect(**st.secrets["postgres"])
+        params = dict(st.secrets["postgres"])
+        return create_engine("postgresql+psycopg2://", creator=lambda: psycopg2.connect(**params), **OPCIONES_POOL)
     except Exception as e:
         st.error(f"Error conectando a Postgres: {e}")
         return None
 
-@st.cache_data(ttl=3600)
-def get_sectores_cached():
-    conn = get_postgres_conn()
-    if conn is None:
-        return pd.DataFrame()
+@st.cache_resource(ttl=3600)
+def get_sectores_geojson(zoom):
+    # Se guarda ya parseada y compartida: los polígonos se procesan una vez por hora, no en cada rerun
+    # Los errores no se atrapan aquí para que no queden guardados en la caché: se muestran donde se espera el resultado
+    engine = get_postgres_engine()
+    if engine is None:
+        return None
+    return json.loads(leer_sectores_geojson(engine, zoom))
+
+@st.cache_resource
+def get_asignacion_sectores():
+    # Sector de cada medidor por su ubicación, guardado en disco; a PostGIS solo van los medidores nuevos o movidos
+    return AsignacionSectores()
+
+def cargar_sectores_medidores(df_mapa):
+    engine = get_postgres_engine()
+    if engine is None:
+        return None
     try:
-        query = 'SELECT sector, ST_AsGeoJSON(ST_Transform(geom, 4326)) AS geojson_data FROM "Sectorizacion"."Sectores_hidr"'
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
+        return get_asignacion_sectores().asignar(engine, df_mapa)
     except Exception as e:
-        st.sidebar.error(f"Error en consulta Postgres: {e}")
-        return pd.DataFrame()
+        st.sidebar.error(f"Error asignando sectores en Postgres: {e}")
+        return None
+
+@st.cache_resource
+def get_cache_lecturas():
+    # Compartida entre sesiones: caduca a la hora y no pasa de 512 MB
+    return CacheLecturas(ttl=3600, max_bytes=512 * 1024 ** 2)
+
+@st.cache_resource
+def get_almacen_diario():
+    # Días cerrados guardados en disco; a MySQL solo se piden los días nuevos o modificados
+    return AlmacenDiario()
+
+# Versión de los datos (última Fecha y hora de modificación de HES): forma parte de la clave de caché de cada rango,
+# así que los rangos afectados por lecturas nuevas o tardías se recargan sin vaciar la caché de nadie
+@st.cache_data(ttl=60)
+def get_version_datos():
+    return version_datos(mysql_engine)
+
+@st.cache_resource
+def get_refresco_fondo():
+    # Un solo hilo por proceso: al cambiar la versión precarga "Este mes" y "Última semana" para todas las sesiones
+    almacen = get_almacen_diario()
+    return RefrescoFondo(get_cache_lecturas(), lambda inicio, fin: almacen.leer(mysql_engine, inicio, fin), mysql_engine).iniciar()
+
+def cargar_lecturas(inicio, fin, version=None):
+    # Sesiones que piden a la vez el mismo rango comparten una sola consulta
+    return get_cache_lecturas().obtener(clave_lecturas(inicio, fin, version), lambda: get_almacen_diario().leer(mysql_engine, inicio, fin))
+
+# Entradas por función: cada versión de los datos crea claves nuevas y las viejas ya no se usan;
+# con el límite se descartan las menos usadas en lugar de esperar al TTL
+MAX_ENTRADAS_CACHE = 32
+
+# Modo "agregación en servidor": MySQL devuelve una fila por medidor y una por día
+# (st.cache_data ya calcula una sola vez cada clave aunque la pidan varias sesiones a la vez)
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_agregado_medidores(inicio, fin, filtros=(), version=None):
+    return leer_agregado_medidores(mysql_engine, inicio, fin, filtros)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_medidores_filtrables(inicio, fin, rollup, version=None):
+    # Agregado sin filtrar del que salen las opciones de los filtros. El índice se guarda junto con los datos:
+    # st.cache_data devuelve una copia nueva en cada rerun y, si no, el índice se reconstruiría en cada clic
+    df = leer_rollup_medidores(mysql_engine, inicio, fin) if rollup else leer_agregado_medidores(mysql_engine, inicio, fin)
+    return df, IndiceFiltros(df)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_agregado_diario(inicio, fin, filtros=(), version=None):
+    return leer_agregado_diario(mysql_engine, inicio, fin, filtros)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_historico(inicio, fin, filtros=(), version=None):
+    return leer_historico(mysql_engine, inicio, fin, filtros)
+
+# Modo "resúmenes": rangos de meses completos respondidos con HES_MEDIDOR_MES / HES_SECTOR_DIA (rollups_hes.py)
+@st.cache_data(ttl=300)
+def get_cobertura_rollups():
+    # Días que cubren HES_SECTOR_DIA / HES_MEDIDOR_MES (None si rollups_hes.py no se ha ejecutado)
+    return cobertura_rollups(mysql_engine)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_rollup_medidores(inicio, fin, filtros=(), version=None):
+    return leer_rollup_medidores(mysql_engine, inicio, fin, filtros)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_rollup_diario(inicio, fin, filtros=(), version=None):
+    # El resumen diario solo está por sector; con otros filtros se agrega desde HES
+    if any(col != 'Sector' for col, _ in filtros):
+        return leer_agregado_diario(mysql_engine, inicio, fin, filtros)
+    sectores = next((sel for col, sel in filtros if col == 'Sector'), ())
+    return leer_rollup_diario(mysql_engine, inicio, fin, sectores)
+
+@st.cache_data(ttl=3600, max_entries=MAX_ENTRADAS_CACHE)
+def cargar_alarmas(inicio, fin, version=None):
+    # Siempre sobre las lecturas diarias completas del rango; los filtros se aplican después
+    return detectar_alarmas(cargar_lecturas(inicio, fin, version))
+
+@st.cache_resource
+def get_executor():
+    # Hilos compartidos para lanzar en paralelo las consultas a MySQL y Postgres
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="carga_hes")
+
+def en_paralelo(func, *args):
+    # Ejecuta func(*args) en el pool conservando el contexto de la sesión (cachés y mensajes de st)
+    ctx = get_script_run_ctx()
+    def tarea():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+    return get_executor().submit(tarea)
 
 def reiniciar_tablero():
-    st.cache_data.clear()
-    st.cache_resource.clear()
-    time.sleep(1) 
+    # Vuelve a leer la versión de los datos: solo se recargan los rangos que cambiaron, y una vez para todas las sesiones
+    get_version_datos.clear()
+    # Los polígonos de sectores no dependen de la versión de HES: se vuelven a pedir a Postgres
+    get_sectores_geojson.clear()
+    get_asignacion_sectores().revisar_firma()
+    # El rango que se está viendo se vuelve a pedir al almacén, que revisa la firma de cada día en MySQL
+    # (si MySQL no informa la hora de modificación, es lo único que detecta lecturas tardías de días pasados)
+    st.session_state["recargar_rango"] = True
     st.rerun()
 
-def get_color_logic(nivel, consumo_mes):
-    v = float(consumo_mes) if consumo_mes else 0
-    colors = {"REGULAR": "#00FF00", "NORMAL": "#32CD32", "BAJO": "#FF8C00", "CERO": "#FFFFFF", "MUY ALTO": "#FF0000", "ALTO": "#B22222", "null": "#0000FF"}
-    config = {'DOMESTICO A': [5, 10, 15, 30], 'DOMESTICO B': [6, 11, 20, 30], 'DOMESTICO C': [8, 19, 37, 50]}
-    n = str(nivel).upper()
-    lim = config.get(n, [5, 10, 15, 30])
-    if v <= 0: return colors["CERO"], "CONSUMO CERO"
-    if v <= lim[0]: return colors["BAJO"], "CONSUMO BAJO"
-    if v <= lim[1]: return colors["REGULAR"], "CONSUMO REGULAR"
-    if v <= lim[2]: return colors["NORMAL"], "CONSUMO NORMAL"
-    if v <= lim[3]: return colors["ALTO"], "CONSUMO ALTO"
-    return colors["MUY ALTO"], "CONSUMO MUY ALTO"
+def html_ranking(ranking):
+    # Todo el ranking en un solo bloque HTML (mismo diseño de 3 columnas: ID, valor y barra)
+    max_c = ranking['Consumo_diario'].max() if not ranking.empty else 0
+    filas = ""
+    for nombre, consumo in zip(ranking['nombre'], ranking['Consumo_diario']):
+        pct = (consumo / max_c) * 100 if max_c > 0 else 0
+        filas += f'''<div style="display: grid; grid-template-columns: 1.2fr 0.7fr 1.1fr; gap: 1rem; align-items: center; margin-bottom: 12px;">
+            <p style="font-size: 16px; font-weight: 800; color: #81D4FA; margin: 0; overflow: hidden; text-overflow: ellipsis;">{html.escape(nombre)}</p>
+            <p style="font-size: 16px; font-weight: 800; color: white; text-align: right; margin: 0;">{consumo:,.0f}</p>
+            <div style="width: 100%; background-color: #262626; height: 16px; border-radius: 4px; overflow: hidden;">
+                <div style="width: {pct}%; background-color: #FF0000; height: 16px; border-radius: 4px;"></div>
+            </div>
+        </div>'''
+    return f"<div style='margin-top:15px; margin-bottom: 20px;'>{filas}</div>"
 
 # CARGA DE DATOS ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 mysql_engine = get_mysql_engine()
-df_sec = get_sectores_cached()
+# Los sectores (Postgres) se piden ya, mientras se cargan las lecturas de MySQL
+futuros_sectores = {12: en_paralelo(get_sectores_geojson, 12)}
+
+if mysql_engine is not None:
+    get_refresco_fondo()
 
 ahora = pd.Timestamp.now()
-inicio_mes_actual = ahora.replace(day=1)
-ultimo_dia_mes_pasado = inicio_mes_actual - pd.Timedelta(days=1)
-inicio_mes_pasado = ultimo_dia_mes_pasado.replace(day=1)
-inicio_año_actual = ahora.replace(month=1, day=1)
-inicio_año_pasado = inicio_año_actual - pd.DateOffset(years=1)
-fin_año_pasado = inicio_año_actual - pd.Timedelta(days=1)
 
 with st.sidebar:
     st.image(URL_LOGO_MIAA, use_container_width=True)
     
     if st.button("♻️ Actualizar Datos", use_container_width=True):
-        st.cache_data.clear()
-        st.cache_resource.clear()
-        st.rerun()
+        reiniciar_tablero()
     
     st.divider()
 
@@ -199,52 +312,68 @@ with st.sidebar:
     with st.expander("📅 RANGO DE FECHAS", expanded=True):
         opcion_rango = st.selectbox(
             "Rango predefinido", 
-            ["Este mes", "Última semana", "Mes pasado", "Últimos 6 meses", "Este año", "Año pasado", "Personalizado"], 
+            RANGOS_PREDEFINIDOS, 
             index=0
         )
         
-        # Lógica de fechas simplificada
-        if opcion_rango == "Este mes": default_range = (inicio_mes_actual, ahora)
-        elif opcion_rango == "Última semana": default_range = (ahora - pd.Timedelta(days=7), ahora)
-        elif opcion_rango == "Mes pasado": default_range = (inicio_mes_pasado, ultimo_dia_mes_pasado)
-        elif opcion_rango == "Últimos 6 meses": default_range = (ahora - pd.DateOffset(months=6), ahora)
-        elif opcion_rango == "Este año": default_range = (inicio_año_actual, ahora)
-        elif opcion_rango == "Año pasado": default_range = (inicio_año_pasado, fin_año_pasado)
-        else: default_range = (inicio_mes_actual, ahora)
+        # Lógica de fechas simplificada (compartida con el refresco en segundo plano)
+        default_range = rango_predefinido(opcion_rango, ahora)
 
         try:
             fecha_rango = st.date_input("Periodo", value=default_range, max_value=ahora, format="DD/MM/YYYY", label_visibility="collapsed")
         except:
             st.stop()
+
+        # En servidor solo viajan una fila por medidor y una por día (rangos largos)
+        modo_servidor = st.toggle("Agregar en servidor (MySQL)", value=False, key="modo_servidor")
+        # Meses completos desde las tablas de resumen (se mantienen con rollups_hes.py)
+        modo_rollup = st.toggle("Usar resúmenes mensuales", value=False, key="modo_rollup")
     
 # --- SECCIÓN 2: FILTROS TÉCNICOS ----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
     if len(fecha_rango) == 2:
-        df_hes = pd.read_sql(f"SELECT * FROM HES WHERE Fecha BETWEEN '{fecha_rango[0]}' AND '{fecha_rango[1]}'", mysql_engine)
-        
+        usar_rollup = modo_rollup and meses_completos(fecha_rango[0], fecha_rango[1])
+        if modo_rollup and not usar_rollup:
+            st.caption("El periodo no cubre meses completos: se consultan las lecturas.")
+        elif usar_rollup:
+            # Sin tablas o con resúmenes atrasados se consultan las lecturas en lugar de mostrar meses incompletos
+            try:
+                cobertura = get_cobertura_rollups()
+            except Exception as e:
+                cobertura = None
+                st.sidebar.error(f"Error revisando los resúmenes: {e}")
+            if not rollups_cubren(cobertura, fecha_rango[0], fecha_rango[1]):
+                usar_rollup = False
+                hasta = f" (resumido hasta {cobertura[1]:%d/%m/%Y})" if cobertura else ""
+                st.info(f"Los resúmenes mensuales no cubren el periodo{hasta}; ejecute rollups_hes.py. Se consultan las lecturas.")
+        # Versión con la que se cachea este rango: la de los datos si incluye las lecturas más recientes; si no, la hora de modificación de HES
+        version = version_rango(get_version_datos(), fecha_rango[1]) if mysql_engine is not None else None
+        if st.session_state.pop("recargar_rango", False):
+            get_cache_lecturas().descartar(clave_lecturas(fecha_rango[0], fecha_rango[1], version))
+
+        if usar_rollup or modo_servidor:
+            # Las opciones de los filtros salen del agregado por medidor sin filtrar
+            df_hes = None
+            df_filtro, indice = cargar_medidores_filtrables(fecha_rango[0], fecha_rango[1], usar_rollup, version)
+        else:
+            df_hes = cargar_lecturas(fecha_rango[0], fecha_rango[1], version)
+            df_filtro = df_hes
+            # Las lecturas son el mismo DataFrame compartido en cada rerun: su índice se guarda mientras siga vivo
+            indice = indice_filtros(df_filtro)
+        crono.vuelta("carga", filas=len(df_filtro))
+        if depurar:
+            crono.anotar(bytes=tamano_df(df_filtro))
+
         with st.expander("🔍 FILTROS DE BÚSQUEDA", expanded=False):
-            mapeo_nombres = {
-                "ClienteID_API": "Cliente",
-                "Metodoid_API": "Metodo",
-                "Medidor": "Medidor",
-                "Predio": "Predio",
-                "Colonia": "Colonia",
-                "Giro": "Giro",
-                "Sector": "Sector"
-            }
+            mapeo_nombres = MAPEO_NOMBRES
             
+            # Opciones y filtros sobre códigos enteros precalculados para este conjunto de datos
+            mascara = None
+
             filtros_activos = {}
             for col_real, nombre_amigable in mapeo_nombres.items():
-                if col_real in df_hes.columns:
-                    # 1. Limpieza de opciones: eliminamos ceros, valores vacíos y nulos
-                    opciones_raw = df_hes[col_real].unique()
-                    
-                    # Filtramos: que no sea 0, ni '0', ni nulo, ni string vacío
-                    opciones = [
-                        str(int(float(x))) if str(x).replace('.0', '').isdigit() else str(x) 
-                        for x in opciones_raw 
-                        if pd.notnull(x) and str(x).strip() not in ['0', '0.0', '']
-                    ]
-                    opciones = sorted(list(set(opciones)))
+                if col_real in indice:
+                    # 1. Opciones limpias (sin ceros, vacíos ni nulos) de las filas que dejan los filtros anteriores
+                    opciones = indice.opciones(col_real, mascara)
                     
                     # Layout: Título a la izquierda, Selector a la derecha
                     col_tit, col_sel = st.columns([1, 2])
@@ -255,57 +384,68 @@ with st.sidebar:
                     
                     filtros_activos[col_real] = seleccion
                     
-                    # Aplicar el filtro al DataFrame (considerando que el DF original puede tener los ceros)
+                    # Acumular el filtro como máscara booleana; el DataFrame se recorta una sola vez al final
                     if seleccion:
-                        # Convertimos la columna a string para comparar correctamente con la selección limpia
-                        df_hes = df_hes[df_hes[col_real].astype(str).str.replace('.0', '', regex=False).isin(seleccion)]
+                        filtro = indice.mascara(col_real, seleccion)
+                        mascara = filtro if mascara is None else mascara & filtro
+
+            if mascara is not None:
+                df_filtro = df_filtro[mascara]
+        crono.vuelta("filtros", filas=len(df_filtro))
+
+        # PROCESAMIENTO: una fila por medidor (df_mapa) y una por día (df_diario)
+        if usar_rollup or modo_servidor:
+            filtros_sql = tuple((col, tuple(sel)) for col, sel in filtros_activos.items() if sel)
+            funciones = (cargar_rollup_diario, cargar_historico) if usar_rollup else (cargar_agregado_diario, cargar_historico)
+            futuros = [en_paralelo(f, fecha_rango[0], fecha_rango[1], filtros_sql, version) for f in funciones]
+            # Sin filtros, el agregado por medidor es el mismo que ya se cargó para las opciones de los filtros
+            if filtros_sql:
+                cargar_medidores = cargar_rollup_medidores if usar_rollup else cargar_agregado_medidores
+                df_mapa = cargar_medidores(fecha_rango[0], fecha_rango[1], filtros_sql, version)
+            else:
+                df_mapa = df_filtro
+            df_diario, df_historico = [f.result() for f in futuros]
+        else:
+            df_hes = df_filtro
+            df_mapa = agregado_medidores(df_hes)
+            df_diario = agregado_diario(df_hes)
+            df_historico = df_hes[['Fecha', 'Lectura', 'Consumo_diario']].tail(15).sort_values(by='Fecha', ascending=False)
+
+        # Anillas de consumo (color y etiqueta) para todos los medidores de una vez
+        df_mapa = df_mapa.join(clasificar_consumo(df_mapa['Nivel'], df_mapa['Consumo_diario']))
+        crono.vuelta("agregación", filas=len(df_mapa))
+
+        with st.expander("🗺️ OPCIONES DEL MAPA", expanded=False):
+            # Automático: marcadores individuales en selecciones pequeñas, canvas en las grandes
+            # Vista actual: solo los medidores del área visible, o celdas de densidad con poco zoom
+            modo_capa = st.selectbox("Capa de medidores", MODOS_CAPA_MEDIDORES, index=0, key="modo_capa")
+            # Colorea cada polígono con el consumo de los medidores que caen dentro (no con la columna Sector de HES)
+            coropletas = st.toggle("Colorear sectores por consumo", value=False, key="coropletas")
 
 # --- SECCIÓN 3: RANKING (DISEÑO FIEL A LA IMAGEN) --------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-        with st.expander("🏆 RANKING TOP 10", expanded=True):
-            if not df_hes.empty:
-                ranking_data = df_hes.groupby('Medidor')['Consumo_diario'].sum().sort_values(ascending=False).head(10).reset_index()
-                max_c = ranking_data['Consumo_diario'].max() if not ranking_data.empty else 1
-                
-                st.markdown("<div style='margin-top:15px;'></div>", unsafe_allow_html=True)
-                
-                for _, row in ranking_data.iterrows():
-                    # --- LIMPIEZA DEL NÚMERO DE MEDIDOR ---
-                    # Convertimos a float y luego a int para eliminar el ".0" si existe
-                    try:
-                        medidor_limpio = str(int(float(row['Medidor'])))
-                    except:
-                        medidor_limpio = str(row['Medidor']) # Por si el ID tiene letras
-
-                    rc1, rc2, rc3 = st.columns([1.2, 0.7, 1.1])
-                    
-                    # 1. ID del Medidor Limpio (Azul, Negrita, 16px)
-                    rc1.markdown(f"<p style='font-size: 16px; font-weight: 800; color: #81D4FA; margin-bottom: 12px;'>{medidor_limpio}</p>", unsafe_allow_html=True)
-                    
-                    # 2. Valor Numérico
-                    rc2.markdown(f"<p style='font-size: 16px; font-weight: 800; color: white; text-align: right; margin-bottom: 12px;'>{row['Consumo_diario']:,.0f}</p>", unsafe_allow_html=True)
-                    
-                    # 3. Barra de progreso
-                    pct = (row['Consumo_diario'] / max_c) * 100
-                    rc3.markdown(
-                        f'''<div style="display: flex; align-items: center; height: 24px; margin-bottom: 12px;">
-                            <div style="width: 100%; background-color: #262626; height: 16px; border-radius: 4px; overflow: hidden;">
-                                <div style="width: {pct}%; background-color: #FF0000; height: 16px; border-radius: 4px;"></div>
-                            </div>
-                        </div>''', unsafe_allow_html=True)
-                
-                st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
+        with st.expander(f"🏆 RANKING TOP {st.session_state.get('ranking_n', 10)}", expanded=True):
+            rk1, rk2, rk3 = st.columns(3)
+            n_ranking = rk1.selectbox("Top", [5, 10, 20, 50], index=1, key="ranking_n")
+            orden_ranking = rk2.selectbox("Orden", ["Mayor", "Menor"], index=0, key="ranking_orden")
+            por_ranking = rk3.selectbox("Por", ["Medidor", "Sector", "Colonia"], index=0, key="ranking_por")
+
+            if not df_mapa.empty:
+                # Sale del agregado por medidor (df_mapa) con selección parcial, sin recalcular ni ordenar todo
+                ranking_data = ranking_consumo(df_mapa, n=n_ranking, mayores=(orden_ranking == "Mayor"), por=por_ranking)
+                st.markdown(html_ranking(ranking_data), unsafe_allow_html=True)
             else:
                 st.write("Sin datos")
 
         # Botón de alarmas con margen superior para no pegarse al ranking
         st.markdown('<div style="background-color: #B22222; padding: 10px; border-radius: 5px; text-align: center; margin-top: 20px; font-weight: bold; letter-spacing: 1px;">⚠️ INFORME ALARMAS</div>', unsafe_allow_html=True)
+        ver_alarmas = st.toggle("Mostrar informe de alarmas", value=False, key="ver_alarmas")
+        if ver_alarmas:
+            df_alarmas = cargar_alarmas(fecha_rango[0], fecha_rango[1], version)
+            df_alarmas = df_alarmas[df_alarmas['Medidor'].isin(df_mapa['Medidor'])]
+        crono.vuelta("ranking y alarmas", filas=len(df_alarmas) if ver_alarmas else None)
     else:
         st.stop()
 
-# PROCESAMIENTO
-mapeo_columnas = {'Consumo_diario': 'sum', 'Lectura': 'last', 'Latitud': 'first', 'Longitud': 'first', 'Nivel': 'first', 'ClienteID_API': 'first', 'Nombre': 'first', 'Predio': 'first', 'Domicilio': 'first', 'Colonia': 'first', 'Giro': 'first', 'Sector': 'first', 'Metodoid_API': 'first', 'Primer_instalacion': 'first', 'Fecha': 'last'}
-agg_segura = {col: func for col, func in mapeo_columnas.items() if col in df_hes.columns}
-df_mapa = df_hes.groupby('Medidor').agg(agg_segura).reset_index()
 df_valid_coords = df_mapa[(df_mapa['Latitud'] != 0) & (df_mapa['Longitud'] != 0) & (df_mapa['Latitud'].notnull())]
 
 if not df_valid_coords.empty and (filtros_activos.get("Colonia") or filtros_activos.get("Sector")):
@@ -319,11 +459,11 @@ st.markdown('<div class="titulo-superior">Medidores inteligentes - Tablero de co
 # Indicadores
 m1, m2, m3, m4 = st.columns(4)
 m1.metric("📟 N° de medidores", f"{len(df_mapa):,}")
-consumo_total = df_hes['Consumo_diario'].sum() if 'Consumo_diario' in df_hes.columns else 0
+consumo_total = df_diario['Consumo_diario'].sum()
 m2.metric("💧 Consumo total", f"{consumo_total:,.1f} m³")
-promedio = df_hes['Consumo_diario'].mean() if 'Consumo_diario' in df_hes.columns else 0
+promedio = consumo_total / df_diario['con_consumo'].sum() if df_diario['con_consumo'].sum() else 0
 m3.metric("📈 Promedio diario", f"{promedio:.2f} m³")
-m4.metric("📋 Total lecturas", f"{len(df_hes):,}")
+m4.metric("📋 Total lecturas", f"{int(df_diario['lecturas'].sum()):,}")
 
 col_map, col_der = st.columns([3, 1.2])
 
@@ -338,115 +478,252 @@ with col_map:
     fg_sectores = folium.FeatureGroup(name="Sectores Hidráulicos (QGIS)", show=True)
     fg_medidores = folium.FeatureGroup(name="Medidores Inteligentes", show=True)
 
-    # 3. Procesar y añadir Sectores al grupo fg_sectores
-    if not df_sec.empty:
-        for _, row in df_sec.iterrows():
-            geojson_obj = json.loads(row['geojson_data'])
-            folium.GeoJson(
-                geojson_obj, 
-                style_function=lambda x: {'fillColor': '#00d4ff', 'color': '#00d4ff', 'weight': 1, 'fillOpacity': 0.1}, 
-                highlight_function=lambda x: {'fillColor': '#ffff00', 'color': '#ffff00', 'weight': 3, 'fillOpacity': 0.4}, 
-                tooltip=folium.Tooltip(f"Sector: {row['sector']}", sticky=True)
-            ).add_to(fg_sectores)
+    # 3. Añadir todos los Sectores al grupo fg_sectores como una sola capa GeoJSON
+    if zoom_inicial not in futuros_sectores:
+        futuros_sectores[zoom_inicial] = en_paralelo(get_sectores_geojson, zoom_inicial)
+    with st.spinner("Cargando sectores..."):
+        try:
+            sectores_geojson = futuros_sectores[zoom_inicial].result()
+        except Exception as e:
+            st.sidebar.error(f"Error en consulta Postgres: {e}")
+            sectores_geojson = None
+    crono.vuelta("sectores (espera)", filas=len(sectores_geojson['features']) if sectores_geojson else 0)
+    sector_geo = cargar_sectores_medidores(df_mapa) if coropletas and sectores_geojson and sectores_geojson['features'] else None
+    if sector_geo is not None:
+        df_sectores = consumo_por_sector(df_mapa.assign(Sector_geo=sector_geo))
+        capa_sectores, escala_sectores = capa_coropletas(sectores_geojson, df_sectores)
+        capa_sectores.add_to(fg_sectores)
+        escala_sectores.add_to(m)
+        crono.vuelta("sectores: asignación y totales", filas=int(sector_geo.notnull().sum()))
+    elif sectores_geojson and sectores_geojson['features']:
+        folium.GeoJson(
+            sectores_geojson,
+            style_function=lambda x: {'fillColor': '#00d4ff', 'color': '#00d4ff', 'weight': 1, 'fillOpacity': 0.1},
+            highlight_function=lambda x: {'fillColor': '#ffff00', 'color': '#ffff00', 'weight': 3, 'fillOpacity': 0.4},
+            tooltip=folium.GeoJsonTooltip(fields=['sector'], aliases=['Sector:'], sticky=True)
+        ).add_to(fg_sectores)
 
     # 4. Procesar y añadir Medidores al grupo fg_medidores
-    for _, r in df_mapa.iterrows():
-        if pd.notnull(r['Latitud']) and pd.notnull(r['Longitud']):
-            # Obtener lógica de color y etiqueta
-            color_hex, etiqueta = get_color_logic(r.get('Nivel'), r.get('Consumo_diario', 0))
+    modo_capa = resolver_modo_capa(modo_capa, len(df_mapa))
+    if modo_capa == "Vista actual":
+        # El índice espacial se construye una vez por conjunto de datos (fechas, origen, filtros y versión de los datos),
+        # no en cada movimiento del mapa
+        clave_datos = (tuple(fecha_rango), modo_servidor, usar_rollup, tuple((c, tuple(s)) for c, s in filtros_activos.items() if s), version)
+        guardado = st.session_state.get("indice_espacial")
+        if guardado is None or guardado[0] != clave_datos:
+            guardado = (clave_datos, IndiceEspacial(df_mapa))
+            st.session_state["indice_espacial"] = guardado
+        indice_espacial = guardado[1]
+
+        # Los límites que reportó el navegador solo valen para el mismo mapa base; si cambian los datos o el centro, se parte de la vista inicial
+        origen_vista = (clave_datos, lat_centro, lon_centro, zoom_inicial)
+        vista = st.session_state.get("mapa_vista") or {}
+        limites = limites_folium(vista.get("bounds")) if st.session_state.get("origen_vista") == origen_vista else None
+        if limites is None:
+            limites, zoom_vista, centro_vista = limites_aproximados((lat_centro, lon_centro), zoom_inicial), zoom_inicial, None
+        else:
+            zoom_vista = vista.get("zoom") or zoom_inicial
+            centro_vista = ((limites[0][0] + limites[1][0]) / 2, (limites[0][1] + limites[1][1]) / 2)
+        st.session_state["origen_vista"] = origen_vista
+        capa, n_vista = capa_vista(indice_espacial, limites, zoom_vista)
+        capa.add_to(fg_medidores)
+    elif modo_capa == "Canvas":
+        CapaMedidoresCanvas(df_mapa).add_to(fg_medidores)
+    elif modo_capa == "Clusters":
+        cluster_medidores(df_mapa).add_to(fg_medidores)
+    else:
+        for _, r in df_mapa.iterrows():
+            if pd.notnull(r['Latitud']) and pd.notnull(r['Longitud']):
+                color_hex, etiqueta = r['color'], r['etiqueta']
             
-            # Tu tooltip_html original completo
-            tooltip_html = f"""
-            <div style='font-family: Arial, sans-serif; font-size: 12px; color: #333; line-height: 1.4; padding: 10px; white-space: nowrap; display: inline-block;'>
-                <h5 style='margin:0 0 8px 0; color: #007bff; border-bottom: 1px solid #ccc; padding-bottom: 3px;'>Detalle del Medidor</h5>
-                <b>Cliente:</b> {r.get('ClienteID_API', 'N/A')} - <b>Serie:</b> {r['Medidor']}<br>
-                <b>Fecha instalación:</b> {r.get('Primer_instalacion', 'N/A')}<br>
-                <b>Predio:</b> {r.get('Predio', 'N/A')}<br>
-                <b>Nombre:</b> {r.get('Nombre', 'N/A')}<br>
-                <b>Tarifa:</b> {r.get('Nivel', 'N/A')}<br>
-                <b>Giro:</b> {r.get('Giro', 'N/A')}<br>
-                <b>Dirección:</b> {r.get('Domicilio', 'N/A')}<br>
-                <b>Colonia:</b> {r.get('Colonia', 'N/A')}<br>
-                <b>Sector:</b> {r.get('Sector', 'N/A')}<br>
-                <b>Lectura:</b> {r.get('Lectura', 0):,.2f} (m3) - <b>Última:</b> {r.get('Fecha', 'N/A')}<br>
-                <b>Consumo:</b> {r.get('Consumo_diario', 0):,.2f} (m3) acumulado<br>
-                <b>Tipo de comunicación:</b> {r.get('Metodoid_API', 'Lorawan')}<br><br>
-                <div style='text-align: center; padding: 5px; background-color: {color_hex}22; border-radius: 2px; border: 1px solid {color_hex}; white-space: normal;'>
-                    <b style='color: {color_hex};'>ANILLAS DE CONSUMO: {etiqueta}</b>
+                # Tu tooltip_html original completo
+                tooltip_html = f"""
+                <div style='font-family: Arial, sans-serif; font-size: 12px; color: #333; line-height: 1.4; padding: 10px; white-space: nowrap; display: inline-block;'>
+                    <h5 style='margin:0 0 8px 0; color: #007bff; border-bottom: 1px solid #ccc; padding-bottom: 3px;'>Detalle del Medidor</h5>
+                    <b>Cliente:</b> {r.get('ClienteID_API', 'N/A')} - <b>Serie:</b> {r['Medidor']}<br>
+                    <b>Fecha instalación:</b> {r.get('Primer_instalacion', 'N/A')}<br>
+                    <b>Predio:</b> {r.get('Predio', 'N/A')}<br>
+                    <b>Nombre:</b> {r.get('Nombre', 'N/A')}<br>
+                    <b>Tarifa:</b> {r.get('Nivel', 'N/A')}<br>
+                    <b>Giro:</b> {r.get('Giro', 'N/A')}<br>
+                    <b>Dirección:</b> {r.get('Domicilio', 'N/A')}<br>
+                    <b>Colonia:</b> {r.get('Colonia', 'N/A')}<br>
+                    <b>Sector:</b> {r.get('Sector', 'N/A')}<br>
+                    <b>Lectura:</b> {r.get('Lectura', 0):,.2f} (m3) - <b>Última:</b> {r.get('Fecha', 'N/A')}<br>
+                    <b>Consumo:</b> {r.get('Consumo_diario', 0):,.2f} (m3) acumulado<br>
+                    <b>Tipo de comunicación:</b> {r.get('Metodoid_API', 'Lorawan')}<br><br>
+                    <div style='text-align: center; padding: 5px; background-color: {color_hex}22; border-radius: 2px; border: 1px solid {color_hex}; white-space: normal;'>
+                        <b style='color: {color_hex};'>ANILLAS DE CONSUMO: {etiqueta}</b>
+                    </div>
                 </div>
-            </div>
-            """
+                """
             
-            # Añadir el marcador al grupo fg_medidores en lugar de directamente al mapa
-            folium.CircleMarker(
-                location=[r['Latitud'], r['Longitud']], 
-                radius=3, 
-                color=color_hex, 
-                fill=True, 
-                fill_opacity=0.9, 
-                tooltip=folium.Tooltip(tooltip_html, sticky=True)
-            ).add_to(fg_medidores)
+                # Añadir el marcador al grupo fg_medidores en lugar de directamente al mapa
+                folium.CircleMarker(
+                    location=[r['Latitud'], r['Longitud']], 
+                    radius=3, 
+                    color=color_hex, 
+                    fill=True, 
+                    fill_opacity=0.9, 
+                    tooltip=folium.Tooltip(tooltip_html, sticky=True)
+                ).add_to(fg_medidores)
 
     # 5. Agregar los grupos al mapa y el control de capas
     fg_sectores.add_to(m)
-    fg_medidores.add_to(m)
+    if modo_capa != "Vista actual":
+        fg_medidores.add_to(m)
+    if ver_alarmas:
+        fg_alarmas = folium.FeatureGroup(name="Alarmas", show=True)
+        df_alarmas_mapa = resumen_alarmas(df_alarmas, df_mapa)
+        if not df_alarmas_mapa.empty:
+            capa_alarmas(df_alarmas_mapa).add_to(fg_alarmas)
+        fg_alarmas.add_to(m)
     
     # LayerControl añade el menú desplegable en la esquina superior derecha
-    folium.LayerControl(position='topright', collapsed=False).add_to(m)
-
-    # Renderizar en Streamlit
-    folium_static(m, width=1000, height=650)
-
-    st.markdown("""
-        <div class="map-legend">
-            <div class="legend-item"><div class="legend-color" style="background-color: #00FF00;"></div>CONSUMO REGULAR</div>
-            <div class="legend-item"><div class="legend-color" style="background-color: #32CD32;"></div>CONSUMO NORMAL</div>
-            <div class="legend-item"><div class="legend-color" style="background-color: #FF8C00;"></div>CONSUMO BAJO</div>
-            <div class="legend-item"><div class="legend-color" style="background-color: #FFFFFF; border: 1px solid #555;"></div>CONSUMO CERO</div>
-            <div class="legend-item"><div class="legend-color" style="background-color: #FF0000;"></div>CONSUMO MUY ALTO</div>
-            <div class="legend-item"><div class="legend-color" style="background-color: #B22222;"></div>CONSUMO ALTO</div>
-        </div>
-    """, unsafe_allow_html=True)
+    control_capas = folium.LayerControl(position='topright', collapsed=False)
+
+    if modo_capa == "Vista actual":
+        crono.vuelta("mapa: construcción", filas=n_vista)
+        # El mapa base no cambia al moverse; los medidores de la vista se reemplazan en el navegador sin recargarlo
+        st_folium(m, key="mapa_vista", width=1000, height=650, returned_objects=["bounds", "zoom"],
+                  feature_group_to_add=fg_medidores, layer_control=control_capas, center=centro_vista, zoom=zoom_vista if centro_vista else None)
+        st.caption(f"Vista actual: {n_vista:,} de {len(indice_espacial):,} medidores con coordenadas (incluye un margen alrededor de la vista).")
+        crono.vuelta("mapa: HTML folium")
+    else:
+        control_capas.add_to(m)
+        crono.vuelta("mapa: construcción", filas=len(df_mapa))
+
+        # Renderizar en Streamlit
+        folium_static(m, width=1000, height=650)
+        crono.vuelta("mapa: HTML folium")
+    if depurar:
+        crono.anotar(bytes=len(m.get_root().render()))
+    if sector_geo is not None:
+        sin_sector = len(df_valid_coords) - int(sector_geo.notnull().sum())
+        st.caption(f"Sectores por ubicación: {int(df_sectores['sector_distinto'].sum()):,} medidores tienen en HES un Sector distinto al del polígono "
+                   f"donde están; {sin_sector:,} con coordenadas quedan fuera de todo sector.")
+
+    # Leyenda con el número de medidores en cada anilla
+    conteo_anillas = df_mapa['etiqueta'].value_counts()
+    items_leyenda = ""
+    for etiqueta in ["CONSUMO REGULAR", "CONSUMO NORMAL", "CONSUMO BAJO", "CONSUMO CERO", "CONSUMO MUY ALTO", "CONSUMO ALTO"]:
+        color_hex = COLORES_CONSUMO[etiqueta]
+        borde = " border: 1px solid #555;" if color_hex == "#FFFFFF" else ""
+        items_leyenda += f'<div class="legend-item"><div class="legend-color" style="background-color: {color_hex};{borde}"></div>{etiqueta} ({conteo_anillas.get(etiqueta, 0):,})</div>'
+    st.markdown(f'<div class="map-legend">{items_leyenda}</div>', unsafe_allow_html=True)
 
 with col_der:
     st.write("🟢 **Histórico Reciente**")
-    if not df_hes.empty:
-        st.dataframe(df_hes[['Fecha', 'Lectura', 'Consumo_diario']].tail(15).sort_values(by='Fecha', ascending=False), hide_index=True, use_container_width=True)
+    if not df_historico.empty:
+        st.dataframe(df_historico, hide_index=True, use_container_width=True)
     else:
         st.info("No hay lecturas para el periodo seleccionado.")
 
 # --- INTEGRACIÓN DE GRÁFICOS APILADOS ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 st.divider()
 
-if not df_hes.empty:
-    # 1. Gráfico de Consumo Total por Día (Ancho Completo)
-    df_diario = df_hes.groupby('Fecha')['Consumo_diario'].sum().reset_index()
-    fig_diario = px.bar(
-        df_diario, x='Fecha', y='Consumo_diario', text_auto=',.2f',
-        color_discrete_sequence=['#00d4ff']
-    )
+if not df_diario.empty:
+    gc1, gc2 = st.columns(2)
+    agrupacion = gc1.radio("Agrupar consumo", ["Automático", "Día", "Semana", "Mes"], horizontal=True, key="graf_agrupacion")
+    modo_medidores = gc2.radio("Consumo por medidor", ["Top 50 + otros", "Pareto", "Todos"], horizontal=True, key="graf_medidores")
+
+    # 1. Gráfico de Consumo Total (por día; semanas o meses en rangos largos)
+    if agrupacion == "Automático":
+        agrupacion = frecuencia_automatica((pd.Timestamp(fecha_rango[1]) - pd.Timestamp(fecha_rango[0])).days + 1)
+    df_serie = remuestrear_diario(df_diario, agrupacion)
+    if len(df_serie) > 120:
+        # Series largas: una sola traza WebGL en lugar de cientos de barras con etiqueta
+        fig_diario = go.Figure(go.Scattergl(x=df_serie['Fecha'], y=df_serie['Consumo_diario'], mode='lines', line=dict(color='#00d4ff')))
+    else:
+        fig_diario = px.bar(
+            df_serie, x='Fecha', y='Consumo_diario', text_auto=',.2f' if len(df_serie) <= 31 else False,
+            color_discrete_sequence=['#00d4ff']
+        )
+        fig_diario.update_traces(textposition='outside')
     fig_diario.update_layout(
-        title="Consumo Total por Día",
+        title=f"Consumo Total por {agrupacion}",
         paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
         font_color="white", height=350, margin=dict(l=10, r=10, t=40, b=10)
     )
-    fig_diario.update_traces(textposition='outside')
     fig_diario.update_yaxes(tickformat=",") # Formato de miles en el eje Y
     st.plotly_chart(fig_diario, use_container_width=True)
-
-    # 2. Gráfico de Consumo por Medidor (Ancho Completo - Todos los medidores)
-    df_todos_med = df_mapa.sort_values(by='Consumo_diario', ascending=False)
-    fig_med = px.bar(
-        df_todos_med, x='Medidor', y='Consumo_diario',
-        color_discrete_sequence=['#00d4ff']
-    )
+    crono.vuelta("gráfico diario", filas=len(df_serie))
+    if depurar:
+        crono.anotar(bytes=len(fig_diario.to_json()))
+
+    # 2. Gráfico de Consumo por Medidor (Top + otros, curva de Pareto o todos los medidores)
+    if modo_medidores == "Pareto":
+        df_pareto = curva_pareto(df_mapa)
+        fig_med = go.Figure(go.Scatter(x=df_pareto['pct_medidores'], y=df_pareto['pct_consumo'], mode='lines', fill='tozeroy', line=dict(color='#00d4ff')))
+        fig_med.update_xaxes(title="% de medidores (de mayor a menor consumo)", ticksuffix="%")
+        fig_med.update_yaxes(title="% del consumo total", ticksuffix="%")
+        titulo_med = f"Curva de Pareto del Consumo ({len(df_mapa):,} medidores)"
+    else:
+        if modo_medidores == "Todos":
+            df_todos_med = df_mapa.sort_values(by='Consumo_diario', ascending=False)
+            titulo_med = "Consumo por Medidor (Registros Totales)"
+        else:
+            df_todos_med = top_k_con_otros(df_mapa, k=50)
+            titulo_med = "Consumo por Medidor (Top 50 + otros)"
+        fig_med = px.bar(
+            df_todos_med, x='Medidor', y='Consumo_diario',
+            color_discrete_sequence=['#00d4ff']
+        )
+        fig_med.update_yaxes(tickformat=",") # Formato de miles en el eje Y
+        fig_med.update_xaxes(tickangle=45, type='category') # Categoría para evitar que Plotly agrupe IDs numéricos
     fig_med.update_layout(
-        title="Consumo por Medidor (Registros Totales)",
+        title=titulo_med,
         paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
         font_color="white", height=350, margin=dict(l=10, r=10, t=40, b=10)
     )
-    fig_med.update_yaxes(tickformat=",") # Formato de miles en el eje Y
-    fig_med.update_xaxes(tickangle=45, type='category') # Categoría para evitar que Plotly agrupe IDs numéricos
     st.plotly_chart(fig_med, use_container_width=True)
+    crono.vuelta("gráfico medidores")
+    if depurar:
+        crono.anotar(bytes=len(fig_med.to_json()))
 
+# --- INFORME DE ALARMAS ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+if ver_alarmas:
+    st.divider()
+    st.write(f"⚠️ **Informe de Alarmas** ({df_alarmas['Medidor'].nunique():,} medidores)")
+    conteo_alarmas = df_alarmas['Alarma'].value_counts()
+    columnas_alarmas = st.columns(len(COLORES_ALARMA))
+    for col_alarma, (tipo, color_hex) in zip(columnas_alarmas, COLORES_ALARMA.items()):
+        col_alarma.markdown(f"<span style='color: {color_hex}; font-weight: bold;'>●</span> {tipo}: **{conteo_alarmas.get(tipo, 0):,}**", unsafe_allow_html=True)
+    if not df_alarmas.empty:
+        # st.dataframe permite ordenar por cualquier columna haciendo clic en el encabezado
+        st.dataframe(
+            df_alarmas, hide_index=True, use_container_width=True,
+            column_config={
+                "Fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                "Valor": st.column_config.NumberColumn("Valor", format="%.2f"),
+            }
+        )
+    else:
+        st.info("Sin alarmas para el periodo y filtros seleccionados.")
+    crono.vuelta("informe de alarmas", filas=len(df_alarmas))
 
+# --- PANEL DE RENDIMIENTO ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+with st.sidebar:
+    st.divider()
+    depurar = st.toggle("⏱️ Panel de rendimiento", value=False, key="panel_rendimiento")
+    if depurar:
+        guardar_log = st.toggle("Guardar en log (JSON)", value=False, key="log_rendimiento")
+        st.caption(f"Total: {crono.total:.2f} s")
+        cache = get_cache_lecturas()
+        refresco = get_refresco_fondo() if mysql_engine is not None else None
+        st.caption(f"Caché de lecturas: {len(cache)} rangos, {cache.bytes_usados / 1024 ** 2:,.0f} MB · versión del rango: {version}"
+                   + (f" · último precargado: {refresco.ultimo_refresco:%H:%M}" if refresco is not None and refresco.ultimo_refresco is not None else ""))
+        st.dataframe(
+            crono.como_dataframe(), hide_index=True, use_container_width=True,
+            column_config={
+                "segundos": st.column_config.NumberColumn("s", format="%.3f"),
+                "filas": st.column_config.NumberColumn("filas", format="%d"),
+                "bytes": st.column_config.NumberColumn("bytes", format="%d"),
+            }
+        )
+        if guardar_log:
+            registrar_rendimiento(
+                crono, rango=[str(fecha_rango[0]), str(fecha_rango[1])],
+                modo="resúmenes" if usar_rollup else "servidor" if modo_servidor else "lecturas",
+                filtros={col: sel for col, sel in filtros_activos.items() if sel}, capa=modo_capa,
+            )
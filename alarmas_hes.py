@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+# ALARMAS DE MEDIDORES ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+COLORES_ALARMA = {
+    "CONSUMO CERO": "#FFFFFF",
+    "PICO DE CONSUMO": "#FF00FF",
+    "FLUJO INVERSO": "#FFD700",
+    "SIN COMUNICACIÓN": "#808080",
+}
+
+COLUMNAS_ALARMAS = ['Medidor', 'Alarma', 'Fecha', 'Valor', 'Detalle']
+
+
+def detectar_alarmas(df_hes, dias_cero=3, ventana=7, factor_pico=3.0, minimo_pico=1.0, tolerancia_lectura=0.01, dias_sin_lectura=2):
+    """Alarmas por medidor sobre las lecturas diarias, sin recorrer medidor por medidor.
+
+    * CONSUMO CERO: ``dias_cero`` lecturas seguidas o más sin consumo (se
+      reporta la racha más larga).
+    * PICO DE CONSUMO: consumo mayor que ``factor_pico`` veces la media de
+      las ``ventana`` lecturas anteriores del mismo medidor (y que
+      ``minimo_pico`` m³).
+    * FLUJO INVERSO: la lectura acumulada baja más de ``tolerancia_lectura``.
+    * SIN COMUNICACIÓN: la última lectura del medidor tiene más de
+      ``dias_sin_lectura`` días respecto a la lectura más reciente del rango.
+
+    Devuelve una fila por medidor y tipo de alarma con COLUMNAS_ALARMAS.
+    """
+    if df_hes.empty:
+        return pd.DataFrame(columns=COLUMNAS_ALARMAS)
+
+    df = df_hes[['Medidor', 'Fecha', 'Consumo_diario', 'Lectura']].copy()
+    df['Fecha'] = pd.to_datetime(df['Fecha'])
+    df['Consumo_diario'] = df['Consumo_diario'].astype('float64')
+    df = df.sort_values(['Medidor', 'Fecha'], kind='mergesort').reset_index(drop=True)
+    medidor = df['Medidor']
+    nuevo_medidor = medidor.ne(medidor.shift())
+    consumo = df['Consumo_diario']
+    partes = []
+
+    # 1. Rachas de consumo cero: cada cambio de estado o de medidor abre una racha nueva
+    cero = consumo.fillna(0).le(0)
+    racha = (cero.ne(cero.shift()) | nuevo_medidor).cumsum()
+    largo = cero.groupby(racha).transform('size')
+    en_racha = cero & largo.ge(dias_cero)
+    if en_racha.any():
+        rachas = df[en_racha].groupby(racha[en_racha]).agg(
+            Medidor=('Medidor', 'first'), inicio=('Fecha', 'first'), Fecha=('Fecha', 'last'), Valor=('Fecha', 'size'))
+        rachas = rachas.sort_values('Valor', kind='mergesort').drop_duplicates('Medidor', keep='last')
+        rachas['Alarma'] = "CONSUMO CERO"
+        rachas['Detalle'] = rachas['Valor'].astype(str) + " lecturas seguidas sin consumo desde " + rachas['inicio'].dt.strftime('%d/%m/%Y')
+        partes.append(rachas)
+
+    # 2. Picos contra la media móvil de las lecturas anteriores del mismo medidor
+    previo = consumo.groupby(medidor, sort=False).shift()
+    base = previo.groupby(medidor, sort=False).rolling(ventana, min_periods=3).mean().reset_index(level=0, drop=True)
+    pico = base.notnull() & consumo.gt(np.maximum(base * factor_pico, minimo_pico))
+    if pico.any():
+        picos = df[pico].assign(base=base[pico])
+        picos['Valor'] = (picos['Consumo_diario'] / picos['base'].replace(0, np.nan)).fillna(np.inf)
+        picos = picos.sort_values('Valor', kind='mergesort').drop_duplicates('Medidor', keep='last')
+        picos['Alarma'] = "PICO DE CONSUMO"
+        picos['Detalle'] = (picos['Consumo_diario'].map('{:,.2f}'.format) + " m³ contra media de "
+                            + picos['base'].map('{:,.2f}'.format) + " m³")
+        partes.append(picos)
+
+    # 3. Flujo inverso: la lectura acumulada retrocede
+    delta = df['Lectura'].astype('float64').groupby(medidor, sort=False).diff()
+    inverso = delta.lt(-tolerancia_lectura)
+    if inverso.any():
+        inversos = df[inverso].assign(Valor=-delta[inverso])
+        inversos = inversos.sort_values('Valor', kind='mergesort').drop_duplicates('Medidor', keep='last')
+        inversos['Alarma'] = "FLUJO INVERSO"
+        inversos['Detalle'] = "La lectura bajó " + inversos['Valor'].map('{:,.2f}'.format) + " m³"
+        partes.append(inversos)
+
+    # 4. Medidores sin lecturas recientes
+    ultima = df.groupby('Medidor', sort=False)['Fecha'].max()
+    atraso = (df['Fecha'].max() - ultima).dt.days
+    sin_lectura = atraso[atraso > dias_sin_lectura]
+    if not sin_lectura.empty:
+        mudos = pd.DataFrame({'Medidor': sin_lectura.index, 'Fecha': ultima[sin_lectura.index].to_numpy(), 'Valor': sin_lectura.to_numpy()})
+        mudos['Alarma'] = "SIN COMUNICACIÓN"
+        mudos['Detalle'] = "Sin lecturas desde " + mudos['Fecha'].dt.strftime('%d/%m/%Y') + " (" + mudos['Valor'].astype(str) + " días)"
+        partes.append(mudos)
+
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_ALARMAS)
+    alarmas = pd.concat([p[COLUMNAS_ALARMAS] for p in partes], ignore_index=True)
+    alarmas['Valor'] = alarmas['Valor'].astype('float64')
+    return alarmas.sort_values(['Alarma', 'Valor'], ascending=[True, False], kind='mergesort').reset_index(drop=True)
+
+
+def resumen_alarmas(df_alarmas, df_mapa):
+    """Una fila por medidor con alarma, con coordenadas de df_mapa, para la capa del mapa."""
+    if df_alarmas.empty:
+        return pd.DataFrame(columns=['Medidor', 'Latitud', 'Longitud', 'Alarma', 'Detalle', 'color'])
+    por_medidor = df_alarmas.groupby('Medidor', sort=False).agg(Alarma=('Alarma', ' | '.join), Detalle=('Detalle', ' | '.join)).reset_index()
+    por_medidor['color'] = por_medidor['Alarma'].str.split(' | ', regex=False).str[0].map(COLORES_ALARMA)
+    coords = df_mapa[['Medidor', 'Latitud', 'Longitud']]
+    por_medidor = por_medidor.merge(coords, on='Medidor', how='inner')
+    return por_medidor[por_medidor['Latitud'].notnull() & por_medidor['Longitud'].notnull()]
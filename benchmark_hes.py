@@ -0,0 +1,268 @@
+"""Benchmark del tablero con datos sintéticos (sin MySQL ni Postgres).
+
+Genera lecturas ``HES`` y polígonos de sectores con cardinalidades parecidas
+a las reales, los guarda en un SQLite local y mide cada etapa del tablero
+(carga, filtros, agregación, clasificación, mapa, gráficos y alarmas) a
+distintos números de medidores.
+
+Uso::
+
+    python benchmark_hes.py                                  # 1k, 10k y 100k medidores, 30 días
+    python benchmark_hes.py --medidores 1000 10000 --dias 60
+    python benchmark_hes.py --salida base.json               # guarda los tiempos
+    python benchmark_hes.py --comparar base.json             # falla si alguna etapa es >25 % más lenta
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from sqlalchemy import create_engine
+
+from alarmas_hes import detectar_alarmas
+from hes_utils import (COLUMNAS_HES, AlmacenDiario, agregado_diario, agregado_medidores, clasificar_consumo, consumo_por_sector, indice_filtros,
+                       leer_agregado_medidores, leer_lecturas, remuestrear_diario, top_k_con_otros)
+from mapa_hes import MAX_MARCADORES_INDIVIDUALES, CapaMedidoresCanvas, IndiceEspacial, capa_coropletas, capa_vista, limites_aproximados
+
+CENTRO = (21.8853, -102.2916)
+NIVELES = ["DOMESTICO A", "DOMESTICO B", "DOMESTICO C", "COMERCIAL", "INDUSTRIAL"]
+PESOS_NIVELES = [0.45, 0.30, 0.12, 0.10, 0.03]
+GIROS = ["CASA HABITACION", "COMERCIO", "OFICINA", "ESCUELA", "INDUSTRIA", "GOBIERNO", "BALDIO", "MIXTO"]
+
+
+# DATOS SINTÉTICOS -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def generar_sectores(lado=8, radio=0.08, vertices_por_lado=200):
+    """Cuadrícula de ``lado`` x ``lado`` sectores como FeatureCollection (vértices densos, como los de QGIS)."""
+    lat0, lon0 = CENTRO[0] - radio, CENTRO[1] - radio
+    paso = 2 * radio / lado
+    t = np.linspace(0, 1, vertices_por_lado, endpoint=False)
+    features = []
+    for i in range(lado):
+        for j in range(lado):
+            s, w = lat0 + i * paso, lon0 + j * paso
+            n, e = s + paso, w + paso
+            anillo = np.concatenate([
+                np.column_stack([w + t * paso, np.full_like(t, s)]),
+                np.column_stack([np.full_like(t, e), s + t * paso]),
+                np.column_stack([e - t * paso, np.full_like(t, n)]),
+                np.column_stack([np.full_like(t, w), n - t * paso]),
+            ])
+            anillo = np.vstack([anillo, anillo[:1]]).round(7).tolist()
+            nombre = f"S-{i * lado + j + 1:02d}"
+            features.append({'type': 'Feature', 'id': nombre, 'properties': {'sector': nombre},
+                             'geometry': {'type': 'Polygon', 'coordinates': [anillo]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def generar_medidores(n_medidores, lado=8, radio=0.08, semilla=0):
+    """Atributos fijos de cada medidor; el sector coincide con la celda de la cuadrícula."""
+    rng = np.random.default_rng(semilla)
+    lat = CENTRO[0] + rng.uniform(-radio, radio, n_medidores)
+    lon = CENTRO[1] + rng.uniform(-radio, radio, n_medidores)
+    paso = 2 * radio / lado
+    fila = np.clip(((lat - (CENTRO[0] - radio)) / paso).astype(int), 0, lado - 1)
+    col = np.clip(((lon - (CENTRO[1] - radio)) / paso).astype(int), 0, lado - 1)
+    n_colonias = int(np.clip(n_medidores // 150, 20, 600))
+    medidores = pd.DataFrame({
+        'Medidor': np.arange(10_000_000, 10_000_000 + n_medidores),
+        'ClienteID_API': rng.integers(100_000, 999_999, n_medidores).astype('float64'),
+        'Metodoid_API': rng.choice([1.0, 2.0, 3.0], n_medidores, p=[0.7, 0.2, 0.1]),
+        'Predio': [f"P{p:07d}" for p in rng.integers(0, 9_999_999, n_medidores)],
+        'Colonia': [f"COLONIA {c:03d}" for c in rng.integers(1, n_colonias + 1, n_medidores)],
+        'Giro': rng.choice(GIROS, n_medidores),
+        'Sector': [f"S-{k + 1:02d}" for k in fila * lado + col],
+        'Nivel': rng.choice(NIVELES, n_medidores, p=PESOS_NIVELES),
+        'Nombre': [f"USUARIO {k}" for k in range(n_medidores)],
+        'Domicilio': [f"CALLE {k % 900} #{k % 300}" for k in range(n_medidores)],
+        'Latitud': lat,
+        'Longitud': lon,
+        'Primer_instalacion': pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 700, n_medidores), unit='D'),
+    })
+    # ~1 % sin coordenadas, como en producción
+    sin_coord = rng.random(n_medidores) < 0.01
+    medidores.loc[sin_coord, ['Latitud', 'Longitud']] = 0.0
+    return medidores
+
+
+def generar_hes(n_medidores, n_dias, fin=pd.Timestamp("2026-01-31"), semilla=0):
+    """Lecturas diarias (medidores x días) con consumos lognormales, ceros y lecturas acumuladas."""
+    rng = np.random.default_rng(semilla)
+    medidores = generar_medidores(n_medidores, semilla=semilla)
+    fechas = pd.date_range(end=fin, periods=n_dias, freq='D')
+    base = rng.lognormal(mean=-0.5, sigma=0.8, size=n_medidores)
+    consumo = rng.gamma(2.0, base[:, None] / 2.0, size=(n_medidores, n_dias))
+    consumo[rng.random((n_medidores, n_dias)) < 0.05] = 0.0
+    lectura = rng.uniform(0, 5000, n_medidores)[:, None] + np.cumsum(consumo, axis=1)
+    df = pd.DataFrame({
+        'Medidor': np.repeat(medidores['Medidor'].to_numpy(), n_dias),
+        'Fecha': np.tile(fechas.strftime('%Y-%m-%d 00:00:00').to_numpy(), n_medidores),
+        'Consumo_diario': consumo.ravel().round(3),
+        'Lectura': lectura.ravel().round(3),
+    })
+    return df.merge(medidores, on='Medidor', how='left')[COLUMNAS_HES], fechas
+
+
+def crear_base_sqlite(ruta, df_hes, sectores):
+    """SQLite con la tabla HES (índice por Fecha) y los sectores como GeoJSON."""
+    engine = create_engine(f"sqlite:///{ruta}")
+    df_hes.to_sql("HES", engine, index=False, if_exists="replace", chunksize=50_000)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX idx_hes_fecha ON HES (Fecha)")
+    pd.DataFrame({
+        'sector': [f['properties']['sector'] for f in sectores['features']],
+        'geojson': [json.dumps(f['geometry']) for f in sectores['features']],
+    }).to_sql("Sectores_hidr", engine, index=False, if_exists="replace")
+    return engine
+
+
+def leer_sectores_sqlite(engine):
+    """FeatureCollection de ``Sectores_hidr`` leída del SQLite, como la que el tablero recibe de PostGIS."""
+    df = pd.read_sql("SELECT sector, geojson FROM Sectores_hidr", engine)
+    return {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {"sector": s}, "geometry": json.loads(g)}
+                     for s, g in zip(df['sector'], df['geojson'])],
+    }
+
+
+# ETAPAS ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def medir(resultados, etapa, func, *args, **kwargs):
+    t0 = time.perf_counter()
+    valor = func(*args, **kwargs)
+    resultados[etapa] = round(time.perf_counter() - t0, 4)
+    return valor
+
+
+def correr_escala(n_medidores, n_dias, directorio):
+    """Tiempos (s) de cada etapa del tablero para ``n_medidores`` x ``n_dias`` lecturas."""
+    t = {}
+    df_gen, fechas = medir(t, "generar datos", generar_hes, n_medidores, n_dias)
+    engine = medir(t, "crear SQLite", crear_base_sqlite, os.path.join(directorio, f"hes_{n_medidores}.db"), df_gen, generar_sectores())
+    del df_gen
+    inicio, fin = fechas[0].to_pydatetime(), fechas[-1].to_pydatetime()
+
+    # Carga: consulta directa, almacén por día (frío y caliente) y agregado en SQL
+    df_hes = medir(t, "carga SQL", leer_lecturas, engine, inicio, fin)
+    almacen = AlmacenDiario(os.path.join(directorio, f"almacen_{n_medidores}"))
+    medir(t, "carga almacén (frío)", almacen.leer, engine, inicio, fin)
+    medir(t, "carga almacén (caliente)", almacen.leer, engine, inicio, fin)
+    medir(t, "agregado SQL por medidor", leer_agregado_medidores, engine, inicio, fin)
+    sectores = medir(t, "carga sectores", leer_sectores_sqlite, engine)
+
+    # Filtros: índice y una selección de dos colonias en cascada con el sector
+    indice = medir(t, "índice de filtros", indice_filtros, df_hes)
+    t0 = time.perf_counter()
+    colonias = indice.opciones('Colonia')[:2]
+    mascara = indice.mascara('Colonia', colonias)
+    indice.opciones('Sector', mascara)
+    df_filtrado = df_hes[mascara]
+    t["aplicar filtros"] = round(time.perf_counter() - t0, 4)
+
+    # Agregación y clasificación sobre el conjunto completo
+    df_mapa = medir(t, "agregado por medidor (df_mapa)", agregado_medidores, df_hes)
+    df_diario = medir(t, "agregado diario", agregado_diario, df_hes)
+    clases = medir(t, "clasificación de consumo", clasificar_consumo, df_mapa['Nivel'], df_mapa['Consumo_diario'])
+    df_mapa = df_mapa.join(clases)
+    medir(t, "alarmas", detectar_alarmas, df_hes)
+
+    # Mapa: capa canvas de todos los medidores, capa de sectores y (si cabe) marcadores individuales
+    def construir_mapa():
+        m = folium.Map(location=list(CENTRO), zoom_start=12, tiles="CartoDB dark_matter")
+        fg = folium.FeatureGroup(name="Medidores")
+        CapaMedidoresCanvas(df_mapa).add_to(fg)
+        fg.add_to(m)
+        folium.GeoJson(sectores, tooltip=folium.GeoJsonTooltip(fields=['sector'])).add_to(m)
+        return m.get_root().render()
+    html = medir(t, "mapa canvas + sectores (HTML)", construir_mapa)
+    t["mapa canvas: KB"] = round(len(html) / 1024, 1)
+    if n_medidores <= MAX_MARCADORES_INDIVIDUALES:
+        def marcadores_individuales():
+            m = folium.Map(location=list(CENTRO), zoom_start=12)
+            for lat, lon, color in zip(df_mapa['Latitud'], df_mapa['Longitud'], df_mapa['color']):
+                folium.CircleMarker(location=[lat, lon], radius=3, color=color, fill=True, tooltip=folium.Tooltip("x" * 900)).add_to(m)
+            return m.get_root().render()
+        medir(t, "mapa marcadores individuales (HTML)", marcadores_individuales)
+
+    # Mapa por vista: índice espacial una vez y luego la capa de un área de barrio (zoom 16) y de toda la ciudad (zoom 12)
+    indice_espacial = medir(t, "índice espacial", IndiceEspacial, df_mapa)
+    medir(t, "vista zoom 16 (capa)", capa_vista, indice_espacial, limites_aproximados(CENTRO, 16), 16)
+    medir(t, "vista zoom 12 (densidad)", capa_vista, indice_espacial, limites_aproximados(CENTRO, 12), 12)
+
+    # Coropletas de sectores: en los datos sintéticos el Sector de HES ya coincide con el polígono
+    def coropletas():
+        df_sectores = consumo_por_sector(df_mapa.assign(Sector_geo=df_mapa['Sector']))
+        capa, _ = capa_coropletas(sectores, df_sectores)
+        m = folium.Map(location=list(CENTRO), zoom_start=12)
+        capa.add_to(m)
+        return m.get_root().render()
+    medir(t, "coropletas de sectores (HTML)", coropletas)
+
+    # Gráficos
+    def graficos():
+        serie = remuestrear_diario(df_diario, "Día")
+        fig_diario = px.bar(serie, x='Fecha', y='Consumo_diario')
+        fig_med = px.bar(top_k_con_otros(df_mapa, k=50), x='Medidor', y='Consumo_diario')
+        return len(fig_diario.to_json()) + len(fig_med.to_json())
+    medir(t, "gráficos Plotly (JSON)", graficos)
+
+    t["filas"] = len(df_hes)
+    t["filas filtradas"] = len(df_filtrado)
+    engine.dispose()
+    return t
+
+
+# COMPARACIÓN -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def regresiones(actual, base, tolerancia, minimo=0.05):
+    """Etapas más lentas que en ``base`` por encima de ``tolerancia`` (se ignoran las de < ``minimo`` s)."""
+    lentas = []
+    for escala, etapas in actual.items():
+        for etapa, segundos in etapas.items():
+            anterior = base.get(escala, {}).get(etapa)
+            if anterior is None or etapa in ("filas", "filas filtradas") or etapa.endswith("KB"):
+                continue
+            if segundos > minimo and segundos > anterior * (1 + tolerancia):
+                lentas.append((escala, etapa, anterior, segundos))
+    return lentas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tablero de consumos con datos sintéticos.")
+    parser.add_argument("--medidores", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--salida", help="Guardar resultados en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior contra el cual buscar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Aumento relativo permitido (0.25 = 25 %%)")
+    args = parser.parse_args()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory(prefix="bench_hes_") as directorio:
+        for n in args.medidores:
+            print(f"-- {n:,} medidores x {args.dias} días", flush=True)
+            resultados[str(n)] = correr_escala(n, args.dias, directorio)
+
+    tabla = pd.DataFrame(resultados)
+    tabla.columns = [f"{int(c):,} med." for c in tabla.columns]
+    print(tabla.to_string())
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        lentas = regresiones(resultados, base, args.tolerancia)
+        for escala, etapa, anterior, segundos in lentas:
+            print(f"REGRESIÓN {int(escala):,} medidores - {etapa}: {anterior:.3f} s -> {segundos:.3f} s")
+        if lentas:
+            sys.exit(1)
+        print("Sin regresiones respecto a", args.comparar)
+
+
+if __name__ == "__main__":
+    main()
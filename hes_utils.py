@@ -0,0 +1,979 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+
+# COLUMNAS DEL TABLERO --------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Agregación por medidor usada para construir df_mapa
+MAPEO_COLUMNAS = {'Consumo_diario': 'sum', 'Lectura': 'last', 'Latitud': 'first', 'Longitud': 'first', 'Nivel': 'first', 'ClienteID_API': 'first', 'Nombre': 'first', 'Predio': 'first', 'Domicilio': 'first', 'Colonia': 'first', 'Giro': 'first', 'Sector': 'first', 'Metodoid_API': 'first', 'Primer_instalacion': 'first', 'Fecha': 'last'}
+
+# Columnas que se muestran como filtros en la barra lateral
+MAPEO_NOMBRES = {
+    "ClienteID_API": "Cliente",
+    "Metodoid_API": "Metodo",
+    "Medidor": "Medidor",
+    "Predio": "Predio",
+    "Colonia": "Colonia",
+    "Giro": "Giro",
+    "Sector": "Sector"
+}
+
+# Solo se piden a MySQL las columnas que realmente usa el tablero
+COLUMNAS_HES = list(dict.fromkeys(['Medidor', 'Fecha', *MAPEO_COLUMNAS, *MAPEO_NOMBRES]))
+
+# Tipos compactos: categorías para atributos repetidos, float32 para el consumo
+TIPOS_HES = {
+    'Colonia': 'category',
+    'Giro': 'category',
+    'Sector': 'category',
+    'Nivel': 'category',
+    'Consumo_diario': 'float32',
+    'Lectura': 'float64',
+    'Latitud': 'float64',
+    'Longitud': 'float64',
+}
+
+
+# ANILLAS DE CONSUMO ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Etiquetas en orden creciente de consumo; el índice de cada una es su clase
+ETIQUETAS_CONSUMO = ["CONSUMO CERO", "CONSUMO BAJO", "CONSUMO REGULAR", "CONSUMO NORMAL", "CONSUMO ALTO", "CONSUMO MUY ALTO"]
+COLORES_CONSUMO = {
+    "CONSUMO CERO": "#FFFFFF",
+    "CONSUMO BAJO": "#FF8C00",
+    "CONSUMO REGULAR": "#00FF00",
+    "CONSUMO NORMAL": "#32CD32",
+    "CONSUMO ALTO": "#B22222",
+    "CONSUMO MUY ALTO": "#FF0000",
+}
+
+# Límites superiores (m³) de BAJO, REGULAR, NORMAL y ALTO por tarifa
+UMBRALES_NIVEL = {'DOMESTICO A': [5, 10, 15, 30], 'DOMESTICO B': [6, 11, 20, 30], 'DOMESTICO C': [8, 19, 37, 50]}
+UMBRALES_DEFECTO = [5, 10, 15, 30]
+
+
+def clasificar_consumo(nivel, consumo):
+    """Color y etiqueta de consumo para todos los medidores de una vez.
+
+    ``nivel`` y ``consumo`` son columnas alineadas (p. ej. ``df_mapa['Nivel']``
+    y ``df_mapa['Consumo_diario']``). Devuelve un DataFrame con las columnas
+    categóricas ``color`` y ``etiqueta`` y el mismo índice que ``consumo``.
+    Un consumo nulo se trata como cero.
+    """
+    consumo = pd.Series(consumo)
+    v = pd.to_numeric(consumo, errors='coerce').fillna(0).to_numpy(dtype='float64')
+
+    # Fila de umbrales por medidor; las tarifas desconocidas (código -1) usan la última fila
+    tabla = np.array([*UMBRALES_NIVEL.values(), UMBRALES_DEFECTO], dtype='float64')
+    niveles = pd.Series(nivel, index=consumo.index).astype(str).str.upper()
+    codigos = pd.Categorical(niveles, categories=list(UMBRALES_NIVEL)).codes
+    limites = tabla[codigos]
+
+    # Clase = 0 si no hay consumo; si no, 1 + número de límites superados
+    clase = np.where(v <= 0, 0, 1 + (v[:, None] > limites).sum(axis=1))
+    colores = [COLORES_CONSUMO[e] for e in ETIQUETAS_CONSUMO]
+    return pd.DataFrame({
+        'color': pd.Categorical.from_codes(clase, categories=colores),
+        'etiqueta': pd.Categorical.from_codes(clase, categories=ETIQUETAS_CONSUMO),
+    }, index=consumo.index)
+
+
+# RANKING --------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def limpiar_id(valor):
+    """Identificador sin '.0' (123.0 -> '123'); los que tienen letras se dejan igual."""
+    try:
+        return str(int(float(valor)))
+    except (TypeError, ValueError, OverflowError):
+        return str(valor)
+
+
+def ranking_consumo(df_mapa, n=10, mayores=True, por='Medidor'):
+    """Los ``n`` medidores (o sectores/colonias) de mayor o menor consumo.
+
+    Parte del agregado por medidor ya calculado; con ``por`` distinto de
+    'Medidor' suma antes por esa columna. Usa selección parcial
+    (nlargest/nsmallest) en lugar de ordenar todo. Devuelve un DataFrame con
+    las columnas ``nombre`` y ``Consumo_diario``.
+    """
+    if por == 'Medidor':
+        serie = df_mapa.set_index('Medidor')['Consumo_diario']
+    else:
+        serie = df_mapa.groupby(por, observed=True)['Consumo_diario'].sum()
+    serie = serie.nlargest(n) if mayores else serie.nsmallest(n)
+    return pd.DataFrame({'nombre': [limpiar_id(v) for v in serie.index], 'Consumo_diario': serie.to_numpy()})
+
+
+# GRÁFICOS -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Frecuencias de remuestreo del gráfico diario y su título
+FRECUENCIAS_DIARIO = {"Día": ("D", "Día"), "Semana": ("W-MON", "Semana"), "Mes": ("MS", "Mes")}
+
+
+def frecuencia_automatica(n_dias):
+    """Agrupación del gráfico diario según la longitud del rango."""
+    if n_dias <= 62:
+        return "Día"
+    if n_dias <= 366:
+        return "Semana"
+    return "Mes"
+
+
+def remuestrear_diario(df_diario, agrupacion="Día"):
+    """Consumo total por día, semana (inicia en lunes) o mes."""
+    serie = df_diario.set_index(pd.to_datetime(df_diario['Fecha']))['Consumo_diario']
+    regla, _ = FRECUENCIAS_DIARIO[agrupacion]
+    if agrupacion == "Día":
+        return serie.rename_axis('Fecha').reset_index()
+    etiqueta = 'left' if regla.startswith('W') else None
+    return serie.resample(regla, label=etiqueta, closed=etiqueta).sum().rename_axis('Fecha').reset_index()
+
+
+def top_k_con_otros(df_mapa, k=50):
+    """Los ``k`` medidores de mayor consumo más una barra "Otros" con el resto."""
+    top = df_mapa.set_index('Medidor')['Consumo_diario'].nlargest(k)
+    barras = pd.DataFrame({'Medidor': [limpiar_id(v) for v in top.index], 'Consumo_diario': top.to_numpy()})
+    resto = len(df_mapa) - len(top)
+    if resto > 0:
+        otros = df_mapa['Consumo_diario'].sum() - top.sum()
+        barras.loc[len(barras)] = [f"Otros ({resto:,} medidores)", otros]
+    return barras
+
+
+def curva_pareto(df_mapa, max_puntos=500):
+    """Curva de Pareto: % acumulado del consumo contra % de medidores (de mayor a menor).
+
+    Se reduce a ``max_puntos`` puntos como máximo para no enviar un punto por medidor.
+    """
+    consumo = np.sort(df_mapa['Consumo_diario'].fillna(0).to_numpy(dtype='float64'))[::-1]
+    if len(consumo) == 0:
+        return pd.DataFrame({'pct_medidores': [], 'pct_consumo': []})
+    acumulado = np.cumsum(consumo)
+    total = acumulado[-1] if acumulado[-1] != 0 else 1
+    idx = np.unique(np.linspace(0, len(consumo) - 1, min(max_puntos, len(consumo))).astype(int))
+    return pd.DataFrame({
+        'pct_medidores': (idx + 1) / len(consumo) * 100,
+        'pct_consumo': acumulado[idx] / total * 100,
+    })
+
+
+# ÍNDICE DE FILTROS -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def normalizar_opcion(valor):
+    """Código canónico de un valor de filtro ('123.0' -> '123'); None si es nulo, cero o vacío."""
+    if pd.isnull(valor) or str(valor).strip() in ['0', '0.0', '']:
+        return None
+    texto = str(valor)
+    return str(int(float(texto))) if texto.replace('.0', '').isdigit() else texto
+
+
+class IndiceFiltros:
+    """Códigos canónicos de las columnas de filtro de un DataFrame, calculados una vez.
+
+    Cada columna de MAPEO_NOMBRES se guarda como un Categorical cuyas
+    categorías son las opciones ya limpias y ordenadas; los nulos, ceros y
+    vacíos quedan con código -1. Las opciones y los filtros se resuelven
+    con operaciones sobre los códigos enteros.
+    """
+
+    def __init__(self, df, columnas=MAPEO_NOMBRES):
+        self.n_filas = len(df)
+        self.categorias = {}
+        for col in columnas:
+            if col not in df.columns:
+                continue
+            original = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype('category')
+            # La limpieza se hace sobre los valores distintos, no sobre cada fila
+            canon = [normalizar_opcion(v) for v in original.cat.categories]
+            opciones = sorted(set(c for c in canon if c is not None))
+            posicion = {v: i for i, v in enumerate(opciones)}
+            traduccion = np.array([posicion.get(c, -1) for c in canon] + [-1], dtype='int32')
+            codigos = traduccion[original.cat.codes.to_numpy()]
+            self.categorias[col] = pd.Categorical.from_codes(codigos, categories=opciones)
+
+    def __contains__(self, col):
+        return col in self.categorias
+
+    def opciones(self, col, mascara=None):
+        """Opciones de la columna presentes en las filas de ``mascara`` (todas si es None)."""
+        cat = self.categorias[col]
+        if mascara is None:
+            return list(cat.categories)
+        codigos = cat.codes[mascara]
+        presentes = np.bincount(codigos[codigos >= 0], minlength=len(cat.categories))
+        return list(cat.categories[np.flatnonzero(presentes)])
+
+    def mascara(self, col, seleccion):
+        """Filas cuya columna está en ``seleccion`` (lista de opciones canónicas)."""
+        cat = self.categorias[col]
+        buscados = cat.categories.get_indexer(list(seleccion))
+        return np.isin(cat.codes, buscados[buscados >= 0])
+
+
+_INDICES_FILTROS = {}
+_LOCK_INDICES = threading.Lock()
+
+
+def indice_filtros(df):
+    """IndiceFiltros de ``df``, construido una sola vez mientras el DataFrame siga vivo."""
+    clave = id(df)
+    with _LOCK_INDICES:
+        item = _INDICES_FILTROS.get(clave)
+        if item is not None and item[0]() is df:
+            return item[1]
+    indice = IndiceFiltros(df)
+
+    def _olvidar(ref, clave=clave):
+        with _LOCK_INDICES:
+            if _INDICES_FILTROS.get(clave, (None,))[0] is ref:
+                del _INDICES_FILTROS[clave]
+
+    with _LOCK_INDICES:
+        _INDICES_FILTROS[clave] = (weakref.ref(df, _olvidar), indice)
+    return indice
+
+
+# CONEXIONES ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Pool compartido por todas las sesiones: conexiones verificadas antes de usarse y renovadas cada 30 min
+OPCIONES_POOL = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+
+def url_mysql(creds):
+    """URL de SQLAlchemy para la sección [mysql] de los secrets."""
+    pwd = urllib.parse.quote_plus(creds["password"])
+    return f"mysql+mysqlconnector://{creds['user']}:{pwd}@{creds['host']}/{creds['database']}"
+
+
+# CONSULTAS ----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def limites_rango(inicio, fin):
+    """Parámetros :inicio y :fin de un rango de días completos (``Fecha >= :inicio AND Fecha < :fin``).
+
+    ``fin`` pasa a ser el día siguiente, así que el último día entra completo
+    aunque Fecha tenga hora. Es la regla de todos los modos: lecturas,
+    almacén por día, agregación en servidor y resúmenes.
+    """
+    return {
+        "inicio": pd.Timestamp(inicio).normalize().to_pydatetime(),
+        "fin": (pd.Timestamp(fin).normalize() + pd.Timedelta(days=1)).to_pydatetime(),
+    }
+
+
+def consulta_hes(columnas=COLUMNAS_HES):
+    """Consulta parametrizada de lecturas HES del rango de limites_rango()."""
+    lista = ", ".join(f"`{c}`" for c in columnas)
+    return text(f"SELECT {lista} FROM HES WHERE Fecha >= :inicio AND Fecha < :fin")
+
+
+def aplicar_tipos(df):
+    """Convierte las columnas de lecturas a los tipos compactos de TIPOS_HES."""
+    for col, tipo in TIPOS_HES.items():
+        if col not in df.columns:
+            continue
+        if tipo == 'category':
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(tipo)
+    return df
+
+
+def leer_lecturas(engine, inicio, fin, columnas=COLUMNAS_HES):
+    """Lee las lecturas HES de un rango de fechas con columnas y tipos reducidos."""
+    df = pd.read_sql(consulta_hes(columnas), engine, params=limites_rango(inicio, fin))
+    return aplicar_tipos(df)
+
+
+# AGREGACIÓN EN SERVIDOR -----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def condiciones_hes(inicio, fin, filtros=(), columna_fecha='Fecha'):
+    """WHERE de rango de fechas más filtros de la barra lateral.
+
+    ``filtros`` es una secuencia de pares (columna, valores); solo se aceptan
+    columnas de MAPEO_NOMBRES. Devuelve (sql, params, bindparams expandibles).
+    """
+    partes = [f"`{columna_fecha}` >= :inicio AND `{columna_fecha}` < :fin"]
+    params = limites_rango(inicio, fin)
+    expandibles = []
+    for i, (col, valores) in enumerate(filtros):
+        if col not in MAPEO_NOMBRES or not valores:
+            continue
+        nombre = f"f{i}"
+        partes.append(f"`{col}` IN :{nombre}")
+        params[nombre] = list(valores)
+        expandibles.append(bindparam(nombre, expanding=True))
+    return " AND ".join(partes), params, expandibles
+
+
+def sql_primero_ultimo(filas, grupo, agregados, columnas):
+    """Consulta agrupada que toma el primer/último valor NO nulo de cada columna.
+
+    ``filas`` es el SELECT sobre HES (ya filtrado) con las columnas de
+    ``grupo``, ``Fecha`` y las de ``columnas`` (dict columna -> 'first' |
+    'last'); ``agregados`` son pares (alias, expresión) que se calculan por
+    grupo. Una primera pasada agrupa y obtiene la fecha del primer o último
+    valor no nulo de cada columna; la segunda une las filas a su grupo y se
+    queda con el valor de esa fecha. Son dos recorridos de las filas del
+    rango sin depender de un índice por medidor, y la misma regla que
+    ``first``/``last`` de pandas, que saltan los nulos.
+
+    Columnas del resultado: ``grupo``, ``agregados`` y ``columnas``, en ese orden.
+    """
+    fechas = [f"{'MIN' if func == 'first' else 'MAX'}(CASE WHEN `{col}` IS NOT NULL THEN Fecha END) AS `f_{col}`"
+              for col, func in columnas.items()]
+    union = " AND ".join(f"v.`{g}` = a.`{g}`" for g in grupo)
+    campos = ([f"a.`{g}`" for g in grupo]
+              + [f"MAX(a.`{alias}`) AS `{alias}`" for alias, _ in agregados]
+              + [f"MAX(CASE WHEN v.Fecha = a.`f_{col}` THEN v.`{col}` END) AS `{col}`" for col in columnas])
+    return (
+        f"WITH v AS ({filas}), "
+        f"a AS (SELECT {', '.join(f'`{g}`' for g in grupo)}, {', '.join(f'{expr} AS `{alias}`' for alias, expr in agregados)}, "
+        f"{', '.join(fechas)} FROM v GROUP BY {', '.join(f'`{g}`' for g in grupo)}) "
+        f"SELECT {', '.join(campos)} FROM a JOIN v ON {union} GROUP BY {', '.join(f'a.`{g}`' for g in grupo)}"
+    )
+
+
+def leer_agregado_medidores(engine, inicio, fin, filtros=()):
+    """Una fila por medidor calculada en MySQL con las reglas de MAPEO_COLUMNAS.
+
+    ``sum`` se resuelve con SUM y ``Fecha`` con MAX(Fecha); ``first`` y
+    ``last`` toman el primer y último valor no nulo (sql_primero_ultimo).
+    """
+    where, params, expandibles = condiciones_hes(inicio, fin, filtros)
+    otras = {col: func for col, func in MAPEO_COLUMNAS.items() if func != 'sum' and col != 'Fecha'}
+    sumas = [col for col, func in MAPEO_COLUMNAS.items() if func == 'sum']
+    filas = f"SELECT {', '.join(f'`{c}`' for c in ['Medidor', 'Fecha', *sumas, *otras])} FROM HES WHERE {where}"
+    agregados = [(col, f"SUM(`{col}`)") for col in sumas] + [('Fecha', "MAX(Fecha)")]
+    consulta = text(sql_primero_ultimo(filas, ['Medidor'], agregados, otras)).bindparams(*expandibles)
+    df = pd.read_sql(consulta, engine, params=params)
+    return aplicar_tipos(df[['Medidor', *MAPEO_COLUMNAS]])
+
+
+def leer_agregado_diario(engine, inicio, fin, filtros=()):
+    """Consumo total y número de lecturas por día calculados en MySQL."""
+    where, params, expandibles = condiciones_hes(inicio, fin, filtros)
+    consulta = text(
+        f"SELECT Fecha, SUM(Consumo_diario) AS Consumo_diario, COUNT(*) AS lecturas, COUNT(Consumo_diario) AS con_consumo "
+        f"FROM HES WHERE {where} GROUP BY Fecha ORDER BY Fecha"
+    ).bindparams(*expandibles)
+    return pd.read_sql(consulta, engine, params=params)
+
+
+def leer_historico(engine, inicio, fin, filtros=(), n=15):
+    """Últimas ``n`` lecturas del rango (para el panel de Histórico Reciente)."""
+    where, params, expandibles = condiciones_hes(inicio, fin, filtros)
+    consulta = text(
+        f"SELECT Fecha, Lectura, Consumo_diario FROM HES WHERE {where} ORDER BY Fecha DESC LIMIT {int(n)}"
+    ).bindparams(*expandibles)
+    return pd.read_sql(consulta, engine, params=params)
+
+
+def agregado_medidores(df_hes):
+    """Una fila por medidor a partir de lecturas ya cargadas (reglas de MAPEO_COLUMNAS)."""
+    agg_segura = {col: func for col, func in MAPEO_COLUMNAS.items() if col in df_hes.columns}
+    return df_hes.groupby('Medidor').agg(agg_segura).reset_index()
+
+
+def agregado_diario(df_hes):
+    """Mismo resultado que leer_agregado_diario pero sobre lecturas ya cargadas."""
+    return df_hes.groupby('Fecha').agg(
+        Consumo_diario=('Consumo_diario', 'sum'),
+        lecturas=('Consumo_diario', 'size'),
+        con_consumo=('Consumo_diario', 'count'),
+    ).reset_index()
+
+
+# GEOMETRÍA DE SECTORES (POSTGRES) -----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Todos los sectores en una sola FeatureCollection (propiedad "sector"), simplificados en PostGIS
+CONSULTA_SECTORES_GEOJSON = """
+SELECT json_build_object(
+    'type', 'FeatureCollection',
+    'features', COALESCE(json_agg(json_build_object(
+        'type', 'Feature',
+        'id', sector,
+        'properties', json_build_object('sector', sector),
+        'geometry', ST_AsGeoJSON(ST_SimplifyPreserveTopology(ST_Transform(geom, 4326), %(tolerancia)s), %(decimales)s)::json
+    )), '[]'::json)
+)::text
+FROM "Sectorizacion"."Sectores_hidr"
+"""
+
+
+def tolerancia_zoom(zoom):
+    """Tolerancia de simplificación en grados: aproximadamente un píxel de teselas a ese zoom."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def decimales_zoom(zoom):
+    """Decimales de coordenadas suficientes para el zoom (5 ≈ 1 m)."""
+    return 5 if zoom <= 14 else 6
+
+
+def leer_sectores_geojson(engine, zoom):
+    """FeatureCollection de sectores hidráulicos serializada, lista para Leaflet."""
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(CONSULTA_SECTORES_GEOJSON, {"tolerancia": tolerancia_zoom(zoom), "decimales": decimales_zoom(zoom)}).scalar()
+
+
+# ALMACÉN LOCAL POR DÍA ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+DIR_CACHE_HES = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_hes")
+
+
+class AlmacenDiario:
+    """Almacén en disco de lecturas HES con un archivo Parquet por día.
+
+    Para cada rango se pide a MySQL solo la firma de cada día (número de
+    filas y ``MAX(Fecha)``); se descargan únicamente los días abiertos (hoy
+    en adelante) y los que no están guardados o cuya firma cambió. El resto
+    se lee del disco.
+
+    El candado solo protege el índice y los archivos; las descargas de
+    MySQL van fuera de él. Si dos sesiones necesitan el mismo día, lo
+    descarga una y la otra espera ese resultado.
+    """
+
+    def __init__(self, directorio=DIR_CACHE_HES, columnas=COLUMNAS_HES):
+        self.directorio = directorio
+        self.columnas = list(columnas)
+        self._ruta_indice = os.path.join(directorio, "indice.json")
+        self._lock = threading.Lock()
+        self._en_curso = {}  # día -> Future de la descarga en marcha
+        os.makedirs(directorio, exist_ok=True)
+
+    def leer(self, engine, inicio, fin):
+        inicio = pd.Timestamp(inicio).normalize()
+        fin = pd.Timestamp(fin).normalize()
+        hoy = pd.Timestamp.now().normalize()
+        firma = self._firma_mysql(engine, inicio, fin)
+
+        with self._lock:
+            indice = self._cargar_indice()
+        pendientes = [d for d, f in firma.items() if indice.get(d) != f or pd.Timestamp(d) >= hoy]
+        frescos, propios = self._descargar_compartido(engine, pendientes)
+
+        with self._lock:
+            # Se vuelve a leer: otras sesiones pudieron guardar días mientras se descargaba
+            indice = self._cargar_indice()
+            for dia in propios:
+                if dia in frescos and pd.Timestamp(dia) < hoy:
+                    self._escribir_dia(dia, frescos[dia])
+                    indice[dia] = firma[dia]
+            # Días guardados que ya no tienen lecturas en MySQL
+            for dia in [d for d in indice if inicio <= pd.Timestamp(d) <= fin and d not in firma]:
+                self._borrar_dia(dia)
+                del indice[dia]
+            self._guardar_indice(indice)
+
+        partes = [frescos[d] if d in frescos else pd.read_parquet(self._ruta_dia(d)) for d in sorted(firma) if d in frescos or d in indice]
+        if not partes:
+            return aplicar_tipos(pd.DataFrame(columns=self.columnas))
+        return aplicar_tipos(pd.concat(partes, ignore_index=True))
+
+    def dias_guardados(self):
+        with self._lock:
+            return sorted(self._cargar_indice())
+
+    def limpiar(self):
+        with self._lock:
+            for dia in self._cargar_indice():
+                self._borrar_dia(dia)
+            self._guardar_indice({})
+
+    # MySQL
+    def _firma_mysql(self, engine, inicio, fin):
+        consulta = text(
+            "SELECT DATE(Fecha) AS dia, COUNT(*) AS filas, MAX(Fecha) AS max_fecha "
+            "FROM HES WHERE Fecha >= :inicio AND Fecha < :fin GROUP BY DATE(Fecha)"
+        )
+        df = pd.read_sql(consulta, engine, params=limites_rango(inicio, fin))
+        return {pd.Timestamp(r.dia).strftime('%Y-%m-%d'): [int(r.filas), str(r.max_fecha)] for r in df.itertuples(index=False)}
+
+    def _descargar_compartido(self, engine, dias):
+        """Descarga ``dias``; los que otra sesión ya está descargando se esperan en lugar de pedirlos otra vez.
+
+        Devuelve (frescos, propios): los DataFrames por día y los días descargados por esta llamada.
+        """
+        with self._lock:
+            ajenos = {d: self._en_curso[d] for d in dias if d in self._en_curso}
+            propios = {d: self._en_curso.setdefault(d, Future()) for d in dias if d not in ajenos}
+        try:
+            frescos = self._descargar(engine, list(propios))
+            for dia, futuro in propios.items():
+                futuro.set_result(frescos.get(dia))
+        except BaseException as e:
+            for futuro in propios.values():
+                if not futuro.done():
+                    futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for dia in propios:
+                    del self._en_curso[dia]
+        for dia, futuro in ajenos.items():
+            parte = futuro.result()
+            if parte is not None:
+                frescos[dia] = parte
+        return frescos, list(propios)
+
+    def _descargar(self, engine, dias):
+        """Descarga los días indicados agrupándolos en tramos consecutivos."""
+        frescos = {}
+        lista = ", ".join(f"`{c}`" for c in self.columnas)
+        consulta = text(f"SELECT {lista} FROM HES WHERE Fecha >= :inicio AND Fecha < :fin")
+        for tramo_inicio, tramo_fin in _tramos_consecutivos(dias):
+            df = pd.read_sql(consulta, engine, params=limites_rango(tramo_inicio, tramo_fin))
+            if df.empty:
+                continue
+            df = aplicar_tipos(df)
+            claves = pd.to_datetime(df['Fecha']).dt.strftime('%Y-%m-%d')
+            for dia, parte in df.groupby(claves, sort=False):
+                frescos[dia] = parte.reset_index(drop=True)
+        return frescos
+
+    # Disco
+    def _ruta_dia(self, dia):
+        return os.path.join(self.directorio, f"{dia}.parquet")
+
+    def _escribir_dia(self, dia, df):
+        ruta = self._ruta_dia(dia)
+        df.to_parquet(ruta + ".tmp", index=False)
+        os.replace(ruta + ".tmp", ruta)
+
+    def _borrar_dia(self, dia):
+        try:
+            os.remove(self._ruta_dia(dia))
+        except FileNotFoundError:
+            pass
+
+    def _cargar_indice(self):
+        try:
+            with open(self._ruta_indice, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _guardar_indice(self, indice):
+        with open(self._ruta_indice + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(indice, f)
+        os.replace(self._ruta_indice + ".tmp", self._ruta_indice)
+
+
+def _tramos_consecutivos(dias):
+    """Agrupa fechas 'YYYY-MM-DD' en tramos (inicio, fin) de días seguidos."""
+    tramos = []
+    for dia in sorted(pd.Timestamp(d) for d in dias):
+        if tramos and dia - tramos[-1][1] == pd.Timedelta(days=1):
+            tramos[-1][1] = dia
+        else:
+            tramos.append([dia, dia])
+    return [tuple(t) for t in tramos]
+
+
+# SECTOR HIDRÁULICO POR UBICACIÓN ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Punto en polígono en PostGIS para un lote de medidores; el punto se lleva al SRID de la tabla para usar su índice espacial
+CONSULTA_SECTOR_MEDIDORES = """
+SELECT DISTINCT ON (m.medidor) m.medidor, s.sector::text AS sector
+FROM unnest(%(medidores)s::text[], %(latitudes)s::float8[], %(longitudes)s::float8[]) AS m(medidor, lat, lon)
+JOIN "Sectorizacion"."Sectores_hidr" s
+  ON ST_Contains(s.geom, ST_Transform(ST_SetSRID(ST_MakePoint(m.lon, m.lat), 4326), Find_SRID('Sectorizacion', 'Sectores_hidr', 'geom')))
+ORDER BY m.medidor, s.sector
+"""
+
+# Cambia si se agregan, quitan, renombran o redibujan sectores
+CONSULTA_FIRMA_SECTORES = """
+SELECT COUNT(*) || ':' || COALESCE(SUM(ST_NPoints(geom)), 0) || ':' || COALESCE(MD5(STRING_AGG(sector::text || ST_AsText(ST_Centroid(geom)), ',' ORDER BY sector)), '')
+FROM "Sectorizacion"."Sectores_hidr"
+"""
+
+
+class AsignacionSectores:
+    """Sector hidráulico de cada medidor según su punto y los polígonos de ``Sectores_hidr``.
+
+    Las asignaciones se guardan en un Parquet junto con las coordenadas
+    usadas; en cada llamada solo se consultan en PostGIS los medidores nuevos
+    o que cambiaron de coordenadas. Si cambian los polígonos (firma distinta)
+    se recalcula todo; la firma se revisa como mucho una vez cada
+    ``ttl_firma`` segundos, igual que se refrescan los polígonos del mapa.
+    Los medidores fuera de todo sector quedan con None y tampoco se vuelven
+    a consultar.
+    """
+
+    def __init__(self, directorio=DIR_CACHE_HES, lote=20_000, ttl_firma=3600):
+        self.directorio = directorio
+        self.lote = lote
+        self.ttl_firma = ttl_firma
+        self._ruta = os.path.join(directorio, "sectores_medidores.parquet")
+        self._ruta_firma = os.path.join(directorio, "sectores_firma.txt")
+        self._lock = threading.Lock()
+        self._tabla = None
+        self._firma_revisada = None  # instante (monotonic) de la última revisión de la firma
+        os.makedirs(directorio, exist_ok=True)
+
+    def asignar(self, engine, df_mapa):
+        """Serie alineada con ``df_mapa`` con el sector de cada medidor (None sin coordenadas o fuera de sectores)."""
+        puntos = pd.DataFrame({
+            'Medidor': df_mapa['Medidor'].map(limpiar_id),
+            'Latitud': df_mapa['Latitud'].astype('float64').round(6),
+            'Longitud': df_mapa['Longitud'].astype('float64').round(6),
+        }, index=df_mapa.index)
+        puntos = puntos[puntos['Latitud'].notnull() & puntos['Longitud'].notnull() & (puntos['Latitud'] != 0) & (puntos['Longitud'] != 0)]
+        unicos = puntos.drop_duplicates('Medidor', keep='last').set_index('Medidor')
+
+        with self._lock:
+            tabla = self._cargar(engine)
+            guardados = unicos.join(tabla, rsuffix='_guardada', how='left')
+            pendientes = guardados[
+                guardados['Latitud_guardada'].isnull()
+                | (guardados['Latitud_guardada'] != guardados['Latitud'])
+                | (guardados['Longitud_guardada'] != guardados['Longitud'])
+            ]
+            if not pendientes.empty:
+                nuevos = pendientes[['Latitud', 'Longitud']].assign(Sector_geo=self._consultar(engine, pendientes))
+                tabla = pd.concat([tabla.drop(nuevos.index, errors='ignore'), nuevos])
+                self._guardar(tabla)
+
+        sector = puntos['Medidor'].map(tabla['Sector_geo'])
+        return sector.reindex(df_mapa.index).astype('category').rename('Sector_geo')
+
+    def limpiar(self):
+        with self._lock:
+            for ruta in (self._ruta, self._ruta_firma):
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+            self._tabla = None
+            self._firma_revisada = None
+
+    def revisar_firma(self):
+        """La próxima llamada a ``asignar`` vuelve a comparar la firma de los polígonos."""
+        with self._lock:
+            self._firma_revisada = None
+
+    # PostGIS
+    def _firma_postgis(self, engine):
+        with engine.connect() as conn:
+            return str(conn.exec_driver_sql(CONSULTA_FIRMA_SECTORES).scalar())
+
+    def _consultar(self, engine, pendientes):
+        """Sector de cada medidor de ``pendientes`` (índice Medidor), en lotes de ``self.lote``."""
+        asignados = {}
+        with engine.connect() as conn:
+            for i in range(0, len(pendientes), self.lote):
+                parte = pendientes.iloc[i:i + self.lote]
+                filas = conn.exec_driver_sql(CONSULTA_SECTOR_MEDIDORES, {
+                    "medidores": list(parte.index),
+                    "latitudes": parte['Latitud'].tolist(),
+                    "longitudes": parte['Longitud'].tolist(),
+                }).fetchall()
+                asignados.update(dict(filas))
+        return pd.Series([asignados.get(m) for m in pendientes.index], index=pendientes.index, dtype=object)
+
+    # Disco (la tabla se conserva también en memoria; la firma se revisa como mucho cada ttl_firma)
+    def _cargar(self, engine):
+        ahora = time.monotonic()
+        if self._tabla is not None and self._firma_revisada is not None and ahora - self._firma_revisada < self.ttl_firma:
+            return self._tabla
+        firma = self._firma_postgis(engine)
+        self._firma_revisada = ahora
+        try:
+            with open(self._ruta_firma, encoding="utf-8") as f:
+                vigente = f.read() == firma
+        except FileNotFoundError:
+            vigente = False
+        if not vigente:
+            self._guardar(self._tabla_vacia())
+            with open(self._ruta_firma + ".tmp", "w", encoding="utf-8") as f:
+                f.write(firma)
+            os.replace(self._ruta_firma + ".tmp", self._ruta_firma)
+        elif self._tabla is None:
+            self._tabla = pd.read_parquet(self._ruta) if os.path.exists(self._ruta) else self._tabla_vacia()
+        return self._tabla
+
+    @staticmethod
+    def _tabla_vacia():
+        return pd.DataFrame({'Latitud': pd.Series(dtype='float64'), 'Longitud': pd.Series(dtype='float64'), 'Sector_geo': pd.Series(dtype=object)},
+                            index=pd.Index([], name='Medidor', dtype=object))
+
+    def _guardar(self, tabla):
+        self._tabla = tabla
+        tabla.to_parquet(self._ruta + ".tmp")
+        os.replace(self._ruta + ".tmp", self._ruta)
+
+
+def consumo_por_sector(df_mapa, columna='Sector_geo'):
+    """Medidores y consumo por sector según ``columna``, y cuántos traen otro ``Sector`` en HES."""
+    geo = df_mapa[columna].astype(object)
+    texto = df_mapa['Sector'].map(normalizar_opcion).astype(object)
+    df = pd.DataFrame({
+        'sector': geo,
+        'Consumo_diario': df_mapa['Consumo_diario'].astype('float64'),
+        'distinto': geo.notnull() & (texto != geo.map(normalizar_opcion)),
+    })
+    return df.groupby('sector').agg(
+        medidores=('sector', 'size'), Consumo_diario=('Consumo_diario', 'sum'), sector_distinto=('distinto', 'sum')).reset_index()
+
+
+# CACHÉ EN MEMORIA --------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def tamano_df(df):
+    """Bytes ocupados por un DataFrame (incluye objetos de texto)."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class CacheLecturas:
+    """Caché LRU de DataFrames con caducidad (TTL) y límite total de memoria.
+
+    Cuando la suma de los DataFrames guardados supera ``max_bytes`` se
+    descartan primero los rangos usados hace más tiempo. Los DataFrames se
+    comparten entre sesiones, por lo que no deben modificarse en sitio.
+    ``obtener`` evita cargas repetidas: si varias sesiones piden a la vez la
+    misma clave, solo una la carga y las demás esperan su resultado.
+    """
+
+    def __init__(self, ttl=3600, max_bytes=512 * 1024 ** 2):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()  # clave -> (instante, bytes, df)
+        self._bytes = 0
+        self._en_curso = {}  # clave -> Future de la carga en marcha
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            return self._vigente(clave)
+
+    def obtener(self, clave, cargar):
+        """DataFrame de ``clave``; si falta, ``cargar()`` se ejecuta una sola vez para todas las sesiones que lo piden."""
+        with self._lock:
+            df = self._vigente(clave)
+            if df is not None:
+                return df
+            futuro = self._en_curso.get(clave)
+            propio = futuro is None
+            if propio:
+                futuro = self._en_curso[clave] = Future()
+        if not propio:
+            return futuro.result()
+        try:
+            df = self.put(clave, cargar())
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(df)
+            return df
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+
+    def put(self, clave, df):
+        peso = tamano_df(df)
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+            if peso > self.max_bytes:
+                return df
+            self._datos[clave] = (time.monotonic(), peso, df)
+            self._bytes += peso
+            while self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._datos)))
+        return df
+
+    def descartar(self, clave):
+        """Quita ``clave`` para que la próxima petición la vuelva a cargar."""
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+    @property
+    def bytes_usados(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._datos)
+
+    def _vigente(self, clave):
+        item = self._datos.get(clave)
+        if item is None:
+            return None
+        instante, _, df = item
+        if time.monotonic() - instante > self.ttl:
+            self._quitar(clave)
+            return None
+        self._datos.move_to_end(clave)
+        return df
+
+    def _quitar(self, clave):
+        _, peso, _ = self._datos.pop(clave)
+        self._bytes -= peso
+
+
+# VERSIÓN DE LOS DATOS Y REFRESCO ----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+RANGOS_PREDEFINIDOS = ["Este mes", "Última semana", "Mes pasado", "Últimos 6 meses", "Este año", "Año pasado", "Personalizado"]
+# Rangos que el refresco en segundo plano mantiene cargados para todas las sesiones
+RANGOS_CALIENTES = ("Este mes", "Última semana")
+
+
+def rango_predefinido(opcion, ahora):
+    """(inicio, fin) de una opción de RANGOS_PREDEFINIDOS ("Personalizado" parte de este mes)."""
+    inicio_mes_actual = ahora.replace(day=1)
+    ultimo_dia_mes_pasado = inicio_mes_actual - pd.Timedelta(days=1)
+    inicio_año_actual = ahora.replace(month=1, day=1)
+    if opcion == "Última semana":
+        return ahora - pd.Timedelta(days=7), ahora
+    if opcion == "Mes pasado":
+        return ultimo_dia_mes_pasado.replace(day=1), ultimo_dia_mes_pasado
+    if opcion == "Últimos 6 meses":
+        return ahora - pd.DateOffset(months=6), ahora
+    if opcion == "Este año":
+        return inicio_año_actual, ahora
+    if opcion == "Año pasado":
+        return inicio_año_actual - pd.DateOffset(years=1), inicio_año_actual - pd.Timedelta(days=1)
+    return inicio_mes_actual, ahora
+
+
+def version_datos(engine):
+    """Versión de HES: última Fecha y, si MySQL la informa, hora de la última modificación de la tabla."""
+    with engine.connect() as conn:
+        max_fecha = conn.execute(text("SELECT MAX(Fecha) FROM HES")).scalar()
+        actualizado = conn.execute(text(
+            "SELECT UPDATE_TIME FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = 'HES'")).scalar()
+    return f"{max_fecha}|{actualizado or ''}"
+
+
+def version_rango(version, fin):
+    """Versión con la que se guarda en caché un rango que termina en ``fin``.
+
+    Si el rango llega hasta la última Fecha de HES depende de la versión
+    completa de los datos; si termina antes queda como "cerrado" con solo la
+    hora de modificación de la tabla, así que una lectura tardía de días
+    pasados también lo invalida.
+    """
+    max_fecha, _, actualizado = version.partition('|')
+    if max_fecha in ('', 'None') or pd.Timestamp(fin).normalize() >= pd.Timestamp(max_fecha).normalize():
+        return version
+    return f"cerrado|{actualizado}"
+
+
+def clave_lecturas(inicio, fin, version):
+    """Clave de CacheLecturas: días del rango más su versión."""
+    return str(pd.Timestamp(inicio).date()), str(pd.Timestamp(fin).date()), version
+
+
+class RefrescoFondo:
+    """Hilo que, cuando cambia la versión de los datos, precarga RANGOS_CALIENTES en CacheLecturas.
+
+    ``cargar(inicio, fin)`` devuelve las lecturas de un rango; la carga pasa
+    por ``CacheLecturas.obtener``, así que una sesión que pida el mismo rango
+    mientras tanto espera este resultado en lugar de repetir la consulta.
+    """
+
+    def __init__(self, cache, cargar, engine, rangos=RANGOS_CALIENTES, intervalo=300):
+        self.cache = cache
+        self.cargar = cargar
+        self.engine = engine
+        self.rangos = rangos
+        self.intervalo = intervalo
+        self.version = None
+        self.ultimo_refresco = None
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ciclo, name="refresco_hes", daemon=True)
+                self._hilo.start()
+        return self
+
+    def refrescar(self):
+        """Precarga los rangos calientes si la versión cambió; devuelve la versión actual."""
+        version = version_datos(self.engine)
+        if version != self.version:
+            ahora = pd.Timestamp.now()
+            for opcion in self.rangos:
+                inicio, fin = (t.normalize() for t in rango_predefinido(opcion, ahora))
+                self.cache.obtener(clave_lecturas(inicio, fin, version_rango(version, fin)), lambda: self.cargar(inicio, fin))
+            self.version = version
+            self.ultimo_refresco = ahora
+        return version
+
+    def _ciclo(self):
+        while True:
+            try:
+                self.refrescar()
+            except Exception:
+                logging.getLogger(__name__).exception("Error en el refresco de rangos calientes")
+            time.sleep(self.intervalo)
+
+
+# RENDIMIENTO ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+RUTA_LOG_RENDIMIENTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rendimiento_hes.jsonl")
+
+
+class Cronometro:
+    """Tiempos por etapa de una ejecución del tablero (modo vuelta).
+
+    Cada llamada a ``vuelta`` registra el tiempo transcurrido desde la
+    anterior junto con datos opcionales (filas, bytes, ...).
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self._ultimo = self.inicio
+        self.etapas = []
+
+    def vuelta(self, etapa, **datos):
+        ahora = time.perf_counter()
+        self.etapas.append({"etapa": etapa, "segundos": round(ahora - self._ultimo, 4), **datos})
+        self._ultimo = ahora
+
+    def anotar(self, **datos):
+        """Agrega datos a la última etapa; lo que cuesta medirlos no se carga a la siguiente."""
+        self.etapas[-1].update(datos)
+        self._ultimo = time.perf_counter()
+
+    @property
+    def total(self):
+        return self._ultimo - self.inicio
+
+    def como_dataframe(self):
+        df = pd.DataFrame(self.etapas)
+        for col in ("filas", "bytes"):
+            if col not in df.columns:
+                df[col] = None
+        return df[["etapa", "segundos", "filas", "bytes"]]
+
+
+def get_logger_rendimiento(ruta=RUTA_LOG_RENDIMIENTO):
+    """Logger que agrega una línea JSON por ejecución al archivo de rendimiento."""
+    logger = logging.getLogger("tablero_hes.rendimiento")
+    if not any(getattr(h, "baseFilename", None) == os.path.abspath(ruta) for h in logger.handlers):
+        handler = logging.FileHandler(ruta, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def registrar_rendimiento(cronometro, logger=None, **contexto):
+    """Escribe la ejecución como una línea JSON (marca de tiempo, contexto y etapas)."""
+    registro = {"ts": pd.Timestamp.now().isoformat(timespec="seconds"), **contexto,
+                "total": round(cronometro.total, 4), "etapas": cronometro.etapas}
+    (logger or get_logger_rendimiento()).info(json.dumps(registro, default=str, ensure_ascii=False))
+
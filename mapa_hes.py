@@ -0,0 +1,326 @@
+import json
+
+import folium
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from branca.element import MacroElement
+from folium.plugins import FastMarkerCluster
+from jinja2 import Template
+
+from hes_utils import COLORES_CONSUMO, ETIQUETAS_CONSUMO, limpiar_id
+
+
+# CAPA DE MEDIDORES EN EL NAVEGADOR -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Hasta este número de medidores se dibuja un CircleMarker con tooltip propio por medidor
+MAX_MARCADORES_INDIVIDUALES = 2000
+
+MODOS_CAPA_MEDIDORES = ["Automático", "Marcadores individuales", "Canvas", "Clusters", "Vista actual"]
+
+# Orden de los campos en cada fila del payload (después de lat, lon y clase de consumo)
+CAMPOS_TOOLTIP = ['ClienteID_API', 'Medidor', 'Primer_instalacion', 'Predio', 'Nombre', 'Nivel', 'Giro', 'Domicilio', 'Colonia', 'Sector', 'Lectura', 'Fecha', 'Consumo_diario', 'Metodoid_API']
+
+# Misma ficha que el tooltip de los marcadores individuales, construida al pasar el ratón
+JS_TOOLTIP_MEDIDOR = """
+function(f, colores, etiquetas) {
+    var c = {}; var campos = %s;
+    for (var i = 0; i < campos.length; i++) { c[campos[i]] = f[i + 3]; }
+    function t(v, d) {
+        if (v === null || v === undefined) { return d === undefined ? 'N/A' : d; }
+        return String(v).replace(/[&<>"']/g, function(ch) { return '&#' + ch.charCodeAt(0) + ';'; });
+    }
+    function n(v) { return Number(v || 0).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2}); }
+    var color = colores[f[2]];
+    return "<div style='font-family: Arial, sans-serif; font-size: 12px; color: #333; line-height: 1.4; padding: 10px; white-space: nowrap; display: inline-block;'>"
+        + "<h5 style='margin:0 0 8px 0; color: #007bff; border-bottom: 1px solid #ccc; padding-bottom: 3px;'>Detalle del Medidor</h5>"
+        + "<b>Cliente:</b> " + t(c.ClienteID_API) + " - <b>Serie:</b> " + t(c.Medidor) + "<br>"
+        + "<b>Fecha instalación:</b> " + t(c.Primer_instalacion) + "<br>"
+        + "<b>Predio:</b> " + t(c.Predio) + "<br>"
+        + "<b>Nombre:</b> " + t(c.Nombre) + "<br>"
+        + "<b>Tarifa:</b> " + t(c.Nivel) + "<br>"
+        + "<b>Giro:</b> " + t(c.Giro) + "<br>"
+        + "<b>Dirección:</b> " + t(c.Domicilio) + "<br>"
+        + "<b>Colonia:</b> " + t(c.Colonia) + "<br>"
+        + "<b>Sector:</b> " + t(c.Sector) + "<br>"
+        + "<b>Lectura:</b> " + n(c.Lectura) + " (m3) - <b>Última:</b> " + t(c.Fecha) + "<br>"
+        + "<b>Consumo:</b> " + n(c.Consumo_diario) + " (m3) acumulado<br>"
+        + "<b>Tipo de comunicación:</b> " + t(c.Metodoid_API, 'Lorawan') + "<br><br>"
+        + "<div style='text-align: center; padding: 5px; background-color: " + color + "22; border-radius: 2px; border: 1px solid " + color + "; white-space: normal;'>"
+        + "<b style='color: " + color + ";'>ANILLAS DE CONSUMO: " + etiquetas[f[2]] + "</b></div></div>";
+}""" % json.dumps(CAMPOS_TOOLTIP)
+
+
+def payload_medidores(df_mapa):
+    """Filas compactas [lat, lon, clase, *CAMPOS_TOOLTIP] de los medidores con coordenadas.
+
+    ``clase`` es el índice de la anilla de consumo en ETIQUETAS_CONSUMO. Se
+    devuelve como texto JSON para insertarlo directamente en el HTML.
+    """
+    df = df_mapa[df_mapa['Latitud'].notnull() & df_mapa['Longitud'].notnull()]
+    datos = pd.DataFrame({
+        'lat': df['Latitud'].astype('float64').round(6),
+        'lon': df['Longitud'].astype('float64').round(6),
+        'clase': df['etiqueta'].cat.codes.astype('int8'),
+    })
+    for col in CAMPOS_TOOLTIP:
+        if col not in df.columns:
+            datos[col] = None
+        elif col in ('Lectura', 'Consumo_diario'):
+            datos[col] = df[col].astype('float64').round(2)
+        else:
+            datos[col] = df[col].astype(object).where(df[col].notnull(), None).map(lambda v: v if v is None else str(v))
+    return datos.to_json(orient='values')
+
+
+def _colores_etiquetas():
+    return json.dumps([COLORES_CONSUMO[e] for e in ETIQUETAS_CONSUMO]), json.dumps(ETIQUETAS_CONSUMO)
+
+
+class CapaMedidoresCanvas(MacroElement):
+    """Todos los medidores como circleMarkers sobre un único canvas de Leaflet.
+
+    El HTML solo lleva un arreglo JSON con los datos; los marcadores y sus
+    tooltips se crean en el navegador (el tooltip, al pasar el ratón).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var colores = {{ this.colores }};
+                var etiquetas = {{ this.etiquetas }};
+                var ficha = {{ this.js_tooltip }};
+                var datos = {{ this.datos }};
+                var renderer = L.canvas({padding: 0.5});
+                var grupo = L.featureGroup();
+                for (var i = 0; i < datos.length; i++) {
+                    var f = datos[i];
+                    var marker = L.circleMarker([f[0], f[1]], {renderer: renderer, radius: 3, color: colores[f[2]], fill: true, fillOpacity: 0.9});
+                    marker.fila = f;
+                    grupo.addLayer(marker);
+                }
+                grupo.bindTooltip(function(capa) { return ficha(capa.fila, colores, etiquetas); }, {sticky: true});
+                grupo.addTo({{ this._parent.get_name() }});
+                return grupo;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, df_mapa):
+        super().__init__()
+        self._name = "CapaMedidoresCanvas"
+        self.datos = payload_medidores(df_mapa)
+        self.colores, self.etiquetas = _colores_etiquetas()
+        self.js_tooltip = JS_TOOLTIP_MEDIDOR
+
+
+def cluster_medidores(df_mapa):
+    """FastMarkerCluster de los medidores con el mismo payload y tooltip diferido."""
+    colores, etiquetas = _colores_etiquetas()
+    callback = f"""(function() {{
+        var colores = {colores};
+        var etiquetas = {etiquetas};
+        var ficha = {JS_TOOLTIP_MEDIDOR};
+        return function(row) {{
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{radius: 3, color: colores[row[2]], fill: true, fillOpacity: 0.9}});
+            marker.bindTooltip(function() {{ return ficha(row, colores, etiquetas); }}, {{sticky: true}});
+            return marker;
+        }};
+    }})()"""
+    return FastMarkerCluster(json.loads(payload_medidores(df_mapa)), callback=callback, control=False)
+
+
+def resolver_modo_capa(modo, n_medidores):
+    """Modo efectivo de la capa de medidores ("Automático" depende del tamaño)."""
+    if modo == "Automático":
+        return "Marcadores individuales" if n_medidores <= MAX_MARCADORES_INDIVIDUALES else "Canvas"
+    return modo
+
+
+# SECTORES POR CONSUMO ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def capa_coropletas(sectores_geojson, df_sectores):
+    """Polígonos de sectores coloreados por consumo total y la escala de colores para la leyenda.
+
+    ``df_sectores`` es el resultado de consumo_por_sector; los polígonos sin
+    medidores quedan en gris. No modifica ``sectores_geojson`` (está compartido).
+    """
+    totales = df_sectores.set_index(df_sectores['sector'].astype(str))
+    maximo = float(totales['Consumo_diario'].max()) if not totales.empty else 0.0
+    escala = LinearColormap(['#FFFFB2', '#FD8D3C', '#BD0026'], vmin=0, vmax=maximo or 1.0, caption="Consumo por sector (m³)")
+    features = []
+    for f in sectores_geojson['features']:
+        sector = str(f['properties']['sector'])
+        medidores, consumo = (int(totales.at[sector, 'medidores']), float(totales.at[sector, 'Consumo_diario'])) if sector in totales.index else (0, 0.0)
+        features.append({**f, 'properties': {
+            'sector': sector,
+            'medidores': f"{medidores:,}",
+            'consumo': f"{consumo:,.1f} m³",
+            'color': escala(consumo) if medidores else '#555555',
+        }})
+    capa = folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        style_function=lambda f: {'fillColor': f['properties']['color'], 'color': '#00d4ff', 'weight': 1, 'fillOpacity': 0.55},
+        highlight_function=lambda f: {'color': '#ffff00', 'weight': 3, 'fillOpacity': 0.75},
+        tooltip=folium.GeoJsonTooltip(fields=['sector', 'medidores', 'consumo'], aliases=['Sector:', 'Medidores:', 'Consumo:'], sticky=True),
+    )
+    return capa, escala
+
+
+# CAPA DE ALARMAS --------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def capa_alarmas(df_resumen):
+    """Medidores con alarma como una sola capa GeoJSON de puntos (color de su primera alarma)."""
+    features = [
+        {
+            'type': 'Feature',
+            'id': str(i),
+            'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+            'properties': {'Medidor': limpiar_id(med), 'Alarma': alarma, 'Detalle': detalle, 'color': color},
+        }
+        for i, (med, lat, lon, alarma, detalle, color) in enumerate(zip(
+            df_resumen['Medidor'], df_resumen['Latitud'], df_resumen['Longitud'],
+            df_resumen['Alarma'], df_resumen['Detalle'], df_resumen['color']))
+    ]
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        marker=folium.CircleMarker(radius=6, fill=True, fill_opacity=0.9, weight=2),
+        style_function=lambda f: {'color': f['properties']['color'], 'fillColor': f['properties']['color']},
+        tooltip=folium.GeoJsonTooltip(fields=['Medidor', 'Alarma', 'Detalle'], aliases=['Medidor:', 'Alarma:', 'Detalle:'], sticky=True),
+    )
+
+
+# CARGA POR VISTA (VIEWPORT) ---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Con menos zoom que este, o con más medidores visibles que MAX_MEDIDORES_VISTA, se dibujan celdas de densidad
+ZOOM_MIN_MEDIDORES = 15
+MAX_MEDIDORES_VISTA = 5000
+# Fracción del ancho/alto de la vista que se agrega por cada lado para no redibujar en cada movimiento pequeño
+MARGEN_VISTA = 0.25
+# Lado de la celda de la rejilla del índice, en grados (~200 m)
+CELDA_INDICE = 0.002
+
+
+def limites_folium(bounds):
+    """((sur, oeste), (norte, este)) a partir de los bounds que devuelve st_folium; None si no hay."""
+    try:
+        so, ne = bounds['_southWest'], bounds['_northEast']
+        limites = ((float(so['lat']), float(so['lng'])), (float(ne['lat']), float(ne['lng'])))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return limites if limites[0][0] < limites[1][0] and limites[0][1] < limites[1][1] else None
+
+
+def limites_aproximados(centro, zoom, ancho=1000, alto=650):
+    """Límites de la vista inicial (Web Mercator, 256 px por tesela) antes de que el navegador los reporte."""
+    grados_px = 360 / (256 * 2 ** zoom)
+    dlon = ancho / 2 * grados_px
+    dlat = float(alto / 2 * grados_px * np.cos(np.radians(centro[0])))
+    return (centro[0] - dlat, centro[1] - dlon), (centro[0] + dlat, centro[1] + dlon)
+
+
+class IndiceEspacial:
+    """Rejilla regular sobre Latitud/Longitud de df_mapa, construida una vez por conjunto de datos.
+
+    Los medidores con coordenadas quedan ordenados por celda (fila por fila),
+    así que una consulta por rectángulo solo recorre, en cada fila de la
+    rejilla que cruza, el tramo contiguo de celdas que cae dentro.
+    """
+
+    def __init__(self, df_mapa, celda=CELDA_INDICE):
+        valido = (df_mapa['Latitud'].notnull() & df_mapa['Longitud'].notnull()
+                  & (df_mapa['Latitud'] != 0) & (df_mapa['Longitud'] != 0))
+        df = df_mapa[valido]
+        lat = df['Latitud'].to_numpy(dtype='float64')
+        lon = df['Longitud'].to_numpy(dtype='float64')
+        self.celda = celda
+        self.lat0 = lat.min() if len(lat) else 0.0
+        self.lon0 = lon.min() if len(lon) else 0.0
+        fila = ((lat - self.lat0) // celda).astype('int64')
+        col = ((lon - self.lon0) // celda).astype('int64')
+        self.n_filas = int(fila.max()) + 1 if len(fila) else 0
+        self.n_cols = int(col.max()) + 1 if len(col) else 0
+        claves = fila * self.n_cols + col
+        orden = np.argsort(claves, kind='stable')
+        self.df = df.iloc[orden].reset_index(drop=True)
+        self.claves = claves[orden]
+        self.lat, self.lon = lat[orden], lon[orden]
+        self.consumo = np.nan_to_num(df['Consumo_diario'].to_numpy(dtype='float64')[orden])
+
+    def __len__(self):
+        return len(self.df)
+
+    def posiciones(self, limites, margen=MARGEN_VISTA):
+        """Posiciones (en self.df) de los medidores dentro de ``limites`` ampliados por ``margen``."""
+        (s, o), (n, e) = limites
+        dlat, dlon = (n - s) * margen, (e - o) * margen
+        s, n, o, e = s - dlat, n + dlat, o - dlon, e + dlon
+        if not len(self) or n < self.lat0 or e < self.lon0:
+            return np.empty(0, dtype='int64')
+        f0, f1 = max(int((s - self.lat0) // self.celda), 0), min(int((n - self.lat0) // self.celda), self.n_filas - 1)
+        c0, c1 = max(int((o - self.lon0) // self.celda), 0), min(int((e - self.lon0) // self.celda), self.n_cols - 1)
+        if f0 > f1 or c0 > c1:
+            return np.empty(0, dtype='int64')
+        filas = np.arange(f0, f1 + 1) * self.n_cols
+        desde = np.searchsorted(self.claves, filas + c0, side='left')
+        hasta = np.searchsorted(self.claves, filas + c1, side='right')
+        candidatos = np.concatenate([np.arange(a, b) for a, b in zip(desde, hasta)])
+        dentro = (self.lat[candidatos] >= s) & (self.lat[candidatos] <= n) & (self.lon[candidatos] >= o) & (self.lon[candidatos] <= e)
+        return candidatos[dentro]
+
+    def en_vista(self, limites, margen=MARGEN_VISTA):
+        """Filas de df_mapa dentro de la vista (con margen)."""
+        return self.df.iloc[self.posiciones(limites, margen)]
+
+    def densidad(self, limites, zoom, margen=MARGEN_VISTA, pixeles=40):
+        """Celdas de unos ``pixeles`` px de lado con número de medidores y consumo, solo de la vista."""
+        idx = self.posiciones(limites, margen)
+        # Celdas gruesas = bloques de k x k celdas del índice, con k según el zoom
+        k = max(1, int(round(pixeles * 360 / (256 * 2 ** zoom) / self.celda)))
+        fila, col = self.claves[idx] // self.n_cols // k, self.claves[idx] % self.n_cols // k
+        grupo, inverso = np.unique(fila * (self.n_cols // k + 1) + col, return_inverse=True)
+        lado = k * self.celda
+        s = self.lat0 + grupo // (self.n_cols // k + 1) * lado
+        o = self.lon0 + grupo % (self.n_cols // k + 1) * lado
+        return pd.DataFrame({
+            'sur': s, 'oeste': o, 'norte': s + lado, 'este': o + lado,
+            'medidores': np.bincount(inverso, minlength=len(grupo)),
+            'consumo': np.bincount(inverso, weights=self.consumo[idx], minlength=len(grupo)),
+        })
+
+
+def capa_densidad(df_celdas):
+    """Celdas de densidad como una capa GeoJSON; la opacidad crece con el número de medidores (escala log)."""
+    maximo = np.log1p(df_celdas['medidores'].max()) if not df_celdas.empty else 1.0
+    features = [
+        {
+            'type': 'Feature',
+            'id': str(i),
+            'geometry': {'type': 'Polygon', 'coordinates': [[[o, s], [e, s], [e, n], [o, n], [o, s]]]},
+            'properties': {
+                'medidores': f"{int(c):,}",
+                'consumo': f"{v:,.1f} m³",
+                'opacidad': round(0.15 + 0.6 * np.log1p(c) / maximo, 3),
+            },
+        }
+        for i, (s, o, n, e, c, v) in enumerate(zip(
+            df_celdas['sur'], df_celdas['oeste'], df_celdas['norte'], df_celdas['este'],
+            df_celdas['medidores'], df_celdas['consumo']))
+    ]
+    # GeoJsonTooltip exige que los campos existan en los datos: sin celdas (vista fuera de la ciudad o periodo sin datos) va sin tooltip
+    tooltip = folium.GeoJsonTooltip(fields=['medidores', 'consumo'], aliases=['Medidores:', 'Consumo:'], sticky=True) if features else None
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        style_function=lambda f: {'fillColor': '#00FF00', 'color': '#00FF00', 'weight': 0.5, 'fillOpacity': f['properties']['opacidad']},
+        tooltip=tooltip,
+    )
+
+
+def capa_vista(indice, limites, zoom):
+    """Capa de medidores de la vista y cuántos medidores representa.
+
+    Con zoom suficiente y pocos medidores visibles se dibujan los medidores
+    (canvas con su tooltip); en otro caso, celdas de densidad.
+    """
+    if zoom >= ZOOM_MIN_MEDIDORES:
+        visibles = indice.en_vista(limites)
+        if len(visibles) <= MAX_MEDIDORES_VISTA:
+            return CapaMedidoresCanvas(visibles), len(visibles)
+    celdas = indice.densidad(limites, zoom)
+    return capa_densidad(celdas), int(celdas['medidores'].sum())
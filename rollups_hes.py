@@ -0,0 +1,158 @@
+"""Resúmenes (rollups) de consumo HES en MySQL.
+
+Mantiene dos tablas calculadas a partir de ``HES``:
+
+* ``HES_MEDIDOR_MES``: una fila por medidor y mes con la suma de consumo,
+  la última lectura no nula del mes y el primer valor no nulo de cada atributo.
+* ``HES_SECTOR_DIA``: una fila por sector y día con la suma de consumo.
+
+Uso (desde la carpeta del tablero, con las mismas credenciales de
+``.streamlit/secrets.toml``)::
+
+    python rollups_hes.py                # incremental: desde el último mes resumido
+    python rollups_hes.py --desde 2025-01-01
+    python rollups_hes.py --completo     # reconstruye todo
+"""
+import argparse
+import os
+import time
+import tomllib
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from hes_utils import (MAPEO_COLUMNAS, OPCIONES_POOL, agregado_medidores, aplicar_tipos, condiciones_hes,
+                       sql_primero_ultimo, url_mysql)
+
+TABLA_MEDIDOR_MES = "HES_MEDIDOR_MES"
+TABLA_SECTOR_DIA = "HES_SECTOR_DIA"
+
+# Columnas de atributos del medidor que se copian de su primer valor no nulo en el mes
+_ATRIBUTOS = [c for c, f in MAPEO_COLUMNAS.items() if f == 'first']
+_VALORES = {'Lectura': 'last', **{c: 'first' for c in _ATRIBUTOS}}
+
+SELECT_MEDIDOR_MES = sql_primero_ultimo(
+    "SELECT Medidor, CAST(DATE_FORMAT(Fecha, '%Y-%m-01') AS DATE) AS Mes, Fecha, Consumo_diario, "
+    + ", ".join(f"`{c}`" for c in _VALORES) + " FROM HES WHERE Fecha >= :desde",
+    ['Medidor', 'Mes'],
+    [('Consumo_diario', "SUM(Consumo_diario)"), ('lecturas', "COUNT(*)"), ('con_consumo', "COUNT(Consumo_diario)"),
+     ('primera', "MIN(Fecha)"), ('Fecha', "MAX(Fecha)")],
+    _VALORES,
+)
+
+SELECT_SECTOR_DIA = (
+    "SELECT Sector, DATE(Fecha) AS Fecha, SUM(Consumo_diario) AS Consumo_diario, "
+    "COUNT(*) AS lecturas, COUNT(Consumo_diario) AS con_consumo "
+    "FROM HES WHERE Fecha >= :desde GROUP BY Sector, DATE(Fecha)"
+)
+
+
+# CONSTRUCCIÓN -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def crear_tablas(conn):
+    """Crea las tablas vacías (tipos tomados de HES) si todavía no existen."""
+    existentes = set(pd.read_sql(text("SHOW TABLES"), conn).iloc[:, 0])
+    if TABLA_MEDIDOR_MES not in existentes:
+        conn.execute(text(f"CREATE TABLE {TABLA_MEDIDOR_MES} AS {SELECT_MEDIDOR_MES} LIMIT 0"), {"desde": "9999-01-01"})
+        conn.execute(text(f"ALTER TABLE {TABLA_MEDIDOR_MES} ADD INDEX idx_mes (Mes), ADD INDEX idx_medidor_mes (Medidor, Mes)"))
+    if TABLA_SECTOR_DIA not in existentes:
+        conn.execute(text(f"CREATE TABLE {TABLA_SECTOR_DIA} AS {SELECT_SECTOR_DIA} LIMIT 0"), {"desde": "9999-01-01"})
+        conn.execute(text(f"ALTER TABLE {TABLA_SECTOR_DIA} ADD INDEX idx_fecha (Fecha), ADD INDEX idx_sector_fecha (Sector, Fecha)"))
+
+
+def inicio_incremental(conn):
+    """Primer día del último mes ya resumido (se recalcula completo); None si no hay datos."""
+    ultima = conn.execute(text(f"SELECT MAX(Fecha) FROM {TABLA_SECTOR_DIA}")).scalar()
+    if ultima is None:
+        return None
+    return pd.Timestamp(ultima).replace(day=1).date()
+
+
+def actualizar_rollups(engine, desde=None, completo=False):
+    """Recalcula los resúmenes desde ``desde`` (o desde el último mes resumido).
+
+    Los meses a partir del inicio se borran y se vuelven a insertar en una
+    sola transacción, por lo que el tablero nunca ve un mes a medias.
+    """
+    with engine.begin() as conn:
+        crear_tablas(conn)
+        if completo:
+            desde = pd.Timestamp("1900-01-01").date()
+        elif desde is None:
+            desde = inicio_incremental(conn) or pd.Timestamp("1900-01-01").date()
+        else:
+            desde = pd.Timestamp(desde).replace(day=1).date()
+
+        conn.execute(text(f"DELETE FROM {TABLA_MEDIDOR_MES} WHERE Mes >= :desde"), {"desde": desde})
+        conn.execute(text(f"DELETE FROM {TABLA_SECTOR_DIA} WHERE Fecha >= :desde"), {"desde": desde})
+        n_medidor = conn.execute(text(f"INSERT INTO {TABLA_MEDIDOR_MES} {SELECT_MEDIDOR_MES}"), {"desde": desde}).rowcount
+        n_sector = conn.execute(text(f"INSERT INTO {TABLA_SECTOR_DIA} {SELECT_SECTOR_DIA}"), {"desde": desde}).rowcount
+    return desde, n_medidor, n_sector
+
+
+# LECTURA DESDE EL TABLERO ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def meses_completos(inicio, fin):
+    """True si el rango empieza el día 1 de un mes y termina el último día de un mes."""
+    inicio, fin = pd.Timestamp(inicio), pd.Timestamp(fin)
+    return inicio.day == 1 and (fin + pd.Timedelta(days=1)).day == 1 and inicio <= fin
+
+
+def cobertura_rollups(engine):
+    """(primer día, último día) resumidos en HES_SECTOR_DIA; None si faltan las tablas o están vacías."""
+    inspector = inspect(engine)
+    if not (inspector.has_table(TABLA_MEDIDOR_MES) and inspector.has_table(TABLA_SECTOR_DIA)):
+        return None
+    with engine.connect() as conn:
+        primero, ultimo = conn.execute(text(f"SELECT MIN(Fecha), MAX(Fecha) FROM {TABLA_SECTOR_DIA}")).one()
+        hay_medidores = conn.execute(text(f"SELECT 1 FROM {TABLA_MEDIDOR_MES} LIMIT 1")).scalar() is not None
+    if primero is None or not hay_medidores:
+        return None
+    return pd.Timestamp(primero).date(), pd.Timestamp(ultimo).date()
+
+
+def rollups_cubren(cobertura, inicio, fin):
+    """True si los resúmenes cubren de ``inicio`` a ``fin`` (las dos tablas se actualizan en la misma transacción)."""
+    if cobertura is None:
+        return False
+    primero, ultimo = cobertura
+    return primero <= pd.Timestamp(inicio).date() and ultimo >= pd.Timestamp(fin).date()
+
+
+def leer_rollup_medidores(engine, inicio, fin, filtros=()):
+    """df_mapa (una fila por medidor) a partir de HES_MEDIDOR_MES para meses completos."""
+    where, params, expandibles = condiciones_hes(inicio, fin, filtros, columna_fecha='Mes')
+    consulta = text(f"SELECT * FROM {TABLA_MEDIDOR_MES} WHERE {where} ORDER BY Mes").bindparams(*expandibles)
+    df = pd.read_sql(consulta, engine, params=params)
+    # Mismas reglas que con las lecturas: suma del consumo, última lectura y primeros atributos
+    return aplicar_tipos(agregado_medidores(df))
+
+
+def leer_rollup_diario(engine, inicio, fin, sectores=()):
+    """Consumo y lecturas por día desde HES_SECTOR_DIA (opcionalmente solo algunos sectores)."""
+    filtros = (('Sector', tuple(sectores)),) if sectores else ()
+    where, params, expandibles = condiciones_hes(inicio, fin, filtros)
+    consulta = text(
+        f"SELECT Fecha, SUM(Consumo_diario) AS Consumo_diario, SUM(lecturas) AS lecturas, SUM(con_consumo) AS con_consumo "
+        f"FROM {TABLA_SECTOR_DIA} WHERE {where} GROUP BY Fecha ORDER BY Fecha"
+    ).bindparams(*expandibles)
+    return pd.read_sql(consulta, engine, params=params)
+
+
+# LÍNEA DE COMANDOS ------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Actualiza los resúmenes HES_MEDIDOR_MES y HES_SECTOR_DIA.")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"), help="Archivo de secrets con la sección [mysql]")
+    parser.add_argument("--desde", help="Recalcular desde esta fecha (YYYY-MM-DD; se redondea al inicio del mes)")
+    parser.add_argument("--completo", action="store_true", help="Reconstruir los resúmenes desde el principio")
+    args = parser.parse_args()
+
+    with open(args.secrets, "rb") as f:
+        creds = tomllib.load(f)["mysql"]
+    engine = create_engine(url_mysql(creds), **OPCIONES_POOL)
+
+    t0 = time.perf_counter()
+    desde, n_medidor, n_sector = actualizar_rollups(engine, desde=args.desde, completo=args.completo)
+    print(f"Resúmenes actualizados desde {desde}: {n_medidor:,} filas medidor-mes, {n_sector:,} filas sector-día ({time.perf_counter() - t0:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()